@@ -1,22 +1,27 @@
 import streamlit as st
 import openpyxl
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import io
 import base64
-import zipfile
-import smtplib
-import ssl
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
+import hashlib
 import tempfile
 import os
 import json
 import time
-import qrcode
-import re
 import uuid
+from functools import partial
+from itertools import islice
 import pandas as pd
+import certificate_engine
+import ingest
+import metrics
+import pdf_output
+import qr_stamp
+from registry import CertificateRegistry
+from mailer import (BACKENDS, SECURITY_MODES, SMTPMailer, SMTPSettings,
+                    is_valid_email, send_email, test_email_connection, valid_email_mask)
+from fonts import get_font
+from jobs import FINISHED_STATUSES, JobRunner, JobStore, submit_generation
 
 # Set page config
 st.set_page_config(
@@ -34,8 +39,8 @@ if 'template_file' not in st.session_state:
     st.session_state.template_file = None
 if 'excel_headers' not in st.session_state:
     st.session_state.excel_headers = []
-if 'excel_df' not in st.session_state:
-    st.session_state.excel_df = None
+if 'participant_file' not in st.session_state:
+    st.session_state.participant_file = None
 if 'certificates_generated' not in st.session_state:
     st.session_state.certificates_generated = False
 if 'certificate_files' not in st.session_state:
@@ -44,99 +49,244 @@ if 'active_tab' not in st.session_state:
     st.session_state.active_tab = 0
 if 'errors' not in st.session_state:
     st.session_state.errors = []
-if 'drag_update_data' not in st.session_state:
-    st.session_state.drag_update_data = None
 if 'email_sent_status' not in st.session_state:
     st.session_state.email_sent_status = {}
+if 'smtp_settings' not in st.session_state:
+    st.session_state.smtp_settings = SMTPSettings.from_env()
 
-# Function to handle drag updates
-def process_drag_update():
-    if st.session_state.drag_update_data:
-        try:
-            data = json.loads(st.session_state.drag_update_data)
-            # Update position in session state
-            for i, element in enumerate(st.session_state.text_elements):
-                if element['id'] == data['elementId']:
-                    element['x_pos'] = data['xPos']
-                    element['y_pos'] = data['yPos']
-                    element['actual_x'] = int(st.session_state.template_size[0] * data['xPos'] / 100)
-                    element['actual_y'] = int(st.session_state.template_size[1] * data['yPos'] / 100)
-            # Clear the update data
-            st.session_state.drag_update_data = None
-        except Exception as e:
-            st.session_state.errors.append(f"Error processing drag update: {str(e)}")
+# Background job store and runner, shared by every session in this process
+@st.cache_resource
+def get_job_runner():
+    return JobRunner(JobStore()).start()
+
+job_runner = get_job_runner()
+job_store = job_runner.store
+
+# Restore running or finished jobs after a browser refresh (job ids are kept in the URL)
+for job_key in ('generation_job', 'email_job', 'qr_job'):
+    if job_key not in st.session_state and job_key in st.query_params:
+        st.session_state[job_key] = st.query_params[job_key]
+
+# Drag-and-drop layout editor (static frontend in components/layout_editor)
+layout_editor = st.components.v1.declare_component(
+    "layout_editor",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "layout_editor")
+)
 
-# Function to validate email
-def is_valid_email(email):
-    if not email or pd.isna(email):
+# Function to apply a batch of position edits sent by the layout editor (its on_change callback)
+def apply_layout_edits():
+    edits = st.session_state.get('layout_editor')
+    if not edits:
+        return
+    positions = {position['id']: position for position in edits['positions']}
+    for element in st.session_state.text_elements:
+        position = positions.get(element['id'])
+        if position:
+            element['x_pos'] = position['x_pos']
+            element['y_pos'] = position['y_pos']
+            element['actual_x'] = int(st.session_state.template_size[0] * position['x_pos'] / 100)
+            element['actual_y'] = int(st.session_state.template_size[1] * position['y_pos'] / 100)
+
+# Function to check that enough email settings are present to send
+def email_configured():
+    if not st.session_state.get('sender_email'):
         return False
-    pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
-    return re.match(pattern, str(email)) is not None
+    return bool(st.session_state.get('email_password')) or not st.session_state.smtp_settings.requires_login
 
-# Function to test email connection
-def test_email_connection(email, password):
-    try:
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-            server.login(email, password)
-        return True, "Connection successful"
-    except smtplib.SMTPAuthenticationError:
-        return False, "Authentication failed. Check your email and app password."
-    except smtplib.SMTPException as e:
-        return False, f"SMTP error: {str(e)}"
-    except Exception as e:
-        return False, f"Connection error: {str(e)}"
+# Function to decode an uploaded template once per process
+@st.cache_resource(max_entries=4)
+def decode_template_bytes(template_bytes):
+    return certificate_engine.decode_template(io.BytesIO(template_bytes))
+
+# Function to get the decoded template for the current upload (read-only; draw on a copy)
+def get_template_raster():
+    return decode_template_bytes(st.session_state.template_file.getvalue())
+
+# Downscaled preview base layer, built once per template
+@st.cache_resource(max_entries=4)
+def preview_base_layer(template_digest):
+    return certificate_engine.preview_base(get_template_raster())
+
+# Function to get the Design tab preview as base64 JPEG, re-encoded only when the layout changes
+@st.cache_data(max_entries=32, show_spinner=False)
+def encode_preview(template_digest, layout_key, _text_elements):
+    base, scale = preview_base_layer(template_digest)
+    return base64.b64encode(certificate_engine.render_preview(base, scale, _text_elements)).decode("utf-8")
 
-# Function to send an email with attachment
-def send_email(sender_email, password, recipient_email, subject, body, attachment_path=None):
+# Design tab preview and drag-and-drop editor
+# Runs as a fragment: a batch of moves from the editor reruns only this function.
+@st.fragment
+def design_preview():
     try:
-        # Validate inputs
-        if not all([sender_email, password, recipient_email]):
-            return False, "Missing required email parameters"
-            
-        if not is_valid_email(sender_email) or not is_valid_email(recipient_email):
-            return False, "Invalid email address format"
-
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = recipient_email
-        msg['Subject'] = subject
-        
-        # Add body text
-        msg.attach(MIMEText(body, 'plain'))
-        
-        # Add attachment if provided
-        if attachment_path and os.path.exists(attachment_path):
-            attachment_filename = os.path.basename(attachment_path)
-            with open(attachment_path, 'rb') as file:
-                attachment = MIMEApplication(file.read(), Name=attachment_filename)
-                attachment['Content-Disposition'] = f'attachment; filename="{attachment_filename}"'
-                msg.attach(attachment)
+        # Render at canvas size from a cached base layer; only what the
+        # preview draws goes into the key, so reruns reuse the encoded JPEG
+        layout_key = json.dumps([
+            {key: element.get(key) for key in certificate_engine.LAYOUT_KEYS}
+            for element in st.session_state.text_elements
+        ])
+        img_data = encode_preview(
+            upload_digest(st.session_state.template_file),
+            layout_key,
+            st.session_state.text_elements
+        )
         
-        # Create secure SSL context and send email
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-            server.login(sender_email, password)
-            server.send_message(msg)
-        return True, "Email sent successfully"
-    except smtplib.SMTPAuthenticationError:
-        return False, "Authentication failed. Check your email and app password."
+        st.markdown("### Drag fields to position them on the certificate")
+        layout_editor(
+            image=f"data:image/jpeg;base64,{img_data}",
+            elements=[
+                {key: element[key] for key in ('id', 'field', 'color', 'font_size', 'x_pos', 'y_pos')}
+                for element in st.session_state.text_elements
+            ],
+            template_size=list(st.session_state.template_size),
+            key="layout_editor",
+            default=None,
+            on_change=apply_layout_edits
+        )
     except Exception as e:
-        return False, f"Error sending email: {str(e)}"
+        error_msg = f"Error generating preview: {str(e)}"
+        st.session_state.errors.append(error_msg)
+        st.error(error_msg)
 
-# Clean dataframe to ensure proper types
-def clean_dataframe(df):
-    for col in df.columns:
-        # Convert all columns to string to avoid Arrow serialization issues
-        try:
-            df[col] = df[col].astype(str)
-        except:
-            df[col] = df[col].apply(str)
-    return df
+# Output profile names shown in the Generate tab
+PROFILE_LABELS = {
+    "print": "Print - lossless PNG, full resolution",
+    "email": "Email - JPEG, max 2000px",
+    "archive": "Archive - lossless WebP",
+    "pdf": "PDF - vector text (needs reportlab)",
+}
+
+# Certificates offered for preview in the QR tab
+QR_PREVIEW_LIMIT = 200
+
+# Function to read a file from disk when a download button is clicked
+def read_file_bytes(path):
+    with open(path, "rb") as file:
+        return file.read()
 
-# Process any pending drag updates
-process_drag_update()
+# Function to show a run's throughput, latency percentiles, peak memory and per-stage timings
+def show_pipeline_metrics(summary):
+    latency = summary['latency_ms']
+    peak = max(summary['peak_rss_bytes'] or 0, summary['worker_peak_rss_bytes'] or 0)
+    cols = st.columns(5)
+    cols[0].metric("Rows / sec", f"{summary['rows_per_sec']:.1f}")
+    cols[1].metric("p50 latency", f"{latency.get('p50', 0):.1f} ms")
+    cols[2].metric("p95 latency", f"{latency.get('p95', 0):.1f} ms")
+    cols[3].metric("p99 latency", f"{latency.get('p99', 0):.1f} ms")
+    cols[4].metric("Peak RSS", f"{peak / 1048576:.0f} MB")
+    st.dataframe(pd.DataFrame([
+        {
+            'Stage': stage_name,
+            'Count': stats['count'],
+            'Total (s)': round(stats['total_seconds'], 3),
+            'p50 (ms)': round(stats['p50_ms'], 2),
+            'p95 (ms)': round(stats['p95_ms'], 2),
+            'p99 (ms)': round(stats['p99_ms'], 2),
+        }
+        for stage_name, stats in summary['stages'].items()
+    ]), use_container_width=True, hide_index=True)
+
+# Function to get a job's metrics: live while this process runs it, stored once it has finished
+def job_metrics_summary(job):
+    stored = (job['result'] or {}).get('metrics') if job['status'] in FINISHED_STATUSES else None
+    if stored:
+        return stored
+    live = job_runner.live_metrics.get(job['id'])
+    return live.summary() if live is not None else None
+
+# Function to poll a background job until it stops, updating a progress bar
+# Live stage timings are shown in the Analytics tab meanwhile.
+def wait_for_job(job_id, label):
+    progress_bar = st.progress(0, text=label)
+    while True:
+        job = job_store.get_job(job_id)
+        counts = job_store.row_counts(job_id)
+        total = sum(counts.values())
+        processed = total - counts.get('pending', 0)
+        progress_bar.progress(processed / total if total else 1.0, text=f"{label} {processed}/{total}")
+        if job is None or job['status'] in FINISHED_STATUSES or job['status'] == "paused":
+            live_metrics_panel.empty()
+            return job
+        live = job_runner.live_metrics.get(job_id)
+        if live is not None:
+            with live_metrics_panel.container():
+                st.subheader(f"Live: {label}")
+                show_pipeline_metrics(live.summary())
+        time.sleep(0.5)
+
+# Function to load a finished generation job into the session
+def load_generation_results(job):
+    cert_files = {}
+    email_sent_status = {}
+    certificate_count = 0
+    for row in job_store.finished_rows(job['id']):
+        if row['state'] != "done":
+            continue
+        certificate_count += 1
+        result = row['result']
+        if result['email']:
+            cert_files[result['email']] = result['path']
+            email_sent_status[result['email']] = False  # Initialize as not sent
+    st.session_state.certificate_files = cert_files
+    st.session_state.email_sent_status = email_sent_status
+    st.session_state.certificate_count = certificate_count
+    st.session_state.certificates_zip = job['result']['zip_path']
+    st.session_state.merged_pdf = job['result'].get('merged_pdf_path')
+    st.session_state.certificates_generated = True
+    st.session_state.loaded_generation_job = job['id']
+
+# Function to list the first certificates a generation job rendered, as {filename: path}
+# Capped so listing stays cheap however large the job is, and cached until the job changes
+# (updated_at is only part of the cache key).
+@st.cache_data(max_entries=16)
+def job_certificate_paths(job_id, updated_at, limit=QR_PREVIEW_LIMIT):
+    rows = (row for row in job_store.finished_rows(job_id) if row['state'] == "done")
+    return {row['result']['filename']: row['result']['path'] for row in islice(rows, limit)}
+
+# Function to record the outcome of an email job in the session
+def load_email_results(job):
+    failed_emails = []
+    for row in job_store.finished_rows(job['id']):
+        email = row['payload']['email']
+        if row['state'] == "done":
+            st.session_state.email_sent_status[email] = True
+        else:
+            failed_emails.append((email, row['error']))
+    st.session_state.loaded_email_job = job['id']
+    return failed_emails
+
+# Stream the uploaded participant file as render records, chunk by chunk
+def participant_records(text_elements, email_column=None, profile=certificate_engine.DEFAULT_PROFILE):
+    participant_file = st.session_state.participant_file
+    columns = ingest.required_columns(st.session_state.excel_headers, text_elements, email_column)
+    taken_filenames = set()
+    for chunk in ingest.iter_chunks(participant_file, participant_file.name, columns):
+        yield from certificate_engine.prepare_records(chunk, text_elements, email_column, profile, taken_filenames)
+
+# Function to hash an upload's content once; file_id changes with every new upload
+def upload_digest(uploaded_file):
+    file_id = getattr(uploaded_file, 'file_id', None)
+    digests = st.session_state.setdefault('upload_digests', {})
+    if file_id and file_id in digests:
+        return digests[file_id]
+    digest = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    if file_id:
+        digests[file_id] = digest
+    return digest
+
+# Parsed participant summaries keyed by upload hash, so reruns don't re-read the file.
+# The file itself is passed as _source, which Streamlit leaves out of the cache key.
+@st.cache_data(max_entries=8, show_spinner=False)
+def summarize_participants(digest, name, _source):
+    headers = ingest.read_header(_source, name)
+    return headers, ingest.read_preview(_source, name), ingest.count_rows(_source, name)
+
+# Count invalid addresses in an email column without loading the other columns
+@st.cache_data(max_entries=16, show_spinner=False)
+def count_invalid_emails(digest, name, email_column, _source):
+    return sum(
+        int((~valid_email_mask(chunk[email_column])).sum())
+        for chunk in ingest.iter_chunks(_source, name, [email_column])
+    )
 
 # Title and description with custom design
 st.markdown("""
@@ -174,6 +324,9 @@ tab_names = [
 ]
 tabs = st.tabs(tab_names)
 
+# Filled with live pipeline metrics while a job is being waited on (see wait_for_job)
+live_metrics_panel = tabs[3].empty()
+
 # Tab 1: Upload Files
 with tabs[0]:
     st.header("Upload Your Files")
@@ -201,25 +354,28 @@ with tabs[0]:
     with col2:
         # Upload Excel file
         st.subheader("Participant Data")
-        excel_file = st.file_uploader("Upload Excel file with participant data", type=["xlsx", "xls"], key="excel_uploader")
+        excel_file = st.file_uploader("Upload Excel, CSV or Parquet file with participant data",
+                                      type=ingest.UPLOAD_TYPES, key="excel_uploader")
         
         if excel_file:
             try:
-                # Load Excel data using pandas for better type handling
-                df = pd.read_excel(excel_file, engine='openpyxl')
-                
-                # Clean the dataframe
-                df = clean_dataframe(df)
-                st.session_state.excel_df = df
-                st.session_state.excel_headers = df.columns.tolist()
+                # Only the header and a few preview rows are parsed here. The row count
+                # comes from the file's metadata where it has one (.xlsx, .parquet); a
+                # .csv or .xls is streamed once to count it. Rows are parsed in chunks
+                # when certificates are generated
+                headers, preview, participant_count = summarize_participants(
+                    upload_digest(excel_file), excel_file.name, excel_file
+                )
+                st.session_state.participant_file = excel_file
+                st.session_state.excel_headers = headers
                 
                 # Show Excel preview
-                st.dataframe(df.head(), use_container_width=True)
-                st.success(f"✅ Excel loaded: {len(df)} participants, {len(df.columns)} columns")
+                st.dataframe(preview, use_container_width=True)
+                st.success(f"✅ Participant list loaded: {participant_count} participants, {len(headers)} columns")
                 
                 # Email configuration
                 st.subheader("Email Configuration (Optional)")
-                email_col = st.selectbox("Select email column", options=["None"] + df.columns.tolist(), key="email_column_select")
+                email_col = st.selectbox("Select email column", options=["None"] + headers, key="email_column_select")
                 
                 if email_col != "None":
                     st.session_state.email_column = email_col
@@ -242,12 +398,41 @@ with tabs[0]:
                             help="To send emails using Gmail, you'll need an App Password. This is a 16-character code that gives permission to apps. Get it from Google Account > Security > 2-Step Verification > App passwords."
                         )
                     
+                    # Mail server / transport
+                    with st.expander("Email Server Settings"):
+                        smtp_settings = st.session_state.smtp_settings
+                        smtp_settings.backend = st.selectbox(
+                            "Backend",
+                            options=list(BACKENDS),
+                            index=BACKENDS.index(smtp_settings.backend),
+                            key="smtp_backend_select",
+                            help="'file' writes each email to an .eml file instead of sending it (for offline testing)."
+                        )
+                        if smtp_settings.backend == "smtp":
+                            col_h, col_p, col_s = st.columns([2, 1, 1])
+                            with col_h:
+                                smtp_settings.host = st.text_input("SMTP host", value=smtp_settings.host, key="smtp_host_input")
+                            with col_p:
+                                smtp_settings.port = int(st.number_input("Port", min_value=1, max_value=65535,
+                                                                         value=int(smtp_settings.port), key="smtp_port_input"))
+                            with col_s:
+                                smtp_settings.security = st.selectbox(
+                                    "Security",
+                                    options=list(SECURITY_MODES),
+                                    index=SECURITY_MODES.index(smtp_settings.security),
+                                    key="smtp_security_select"
+                                )
+                        else:
+                            smtp_settings.sink_dir = st.text_input("Output folder for .eml files",
+                                                                   value=smtp_settings.sink_dir, key="smtp_sink_dir_input")
+                    
                     # Test connection button
-                    if st.session_state.get('sender_email') and st.session_state.get('email_password'):
+                    if email_configured():
                         if st.button("Test Email Connection", key="test_email_connection"):
                             success, message = test_email_connection(
                                 st.session_state.sender_email,
-                                st.session_state.email_password
+                                st.session_state.email_password,
+                                st.session_state.smtp_settings
                             )
                             if success:
                                 st.success(message)
@@ -269,8 +454,10 @@ with tabs[0]:
 # Validate email column
 if 'email_column' in st.session_state:
     email_col = st.session_state.email_column
-    invalid_emails = st.session_state.excel_df[email_col].apply(lambda x: not is_valid_email(x) if pd.notna(x) else True)
-    if invalid_emails.any():
+    participant_file = st.session_state.participant_file
+    if participant_file is not None and count_invalid_emails(
+        upload_digest(participant_file), participant_file.name, email_col, participant_file
+    ):
         st.error("Invalid email addresses found in the Excel file. Please correct them and try again.")
 
 # Tab 2: Design Certificate
@@ -395,198 +582,7 @@ with tabs[1]:
             
             # Load the template
             if st.session_state.template_file:
-                try:
-                    # Create preview image
-                    image = Image.open(st.session_state.template_file)
-                    draw = ImageDraw.Draw(image)
-                    
-                    # Draw each text element
-                    for element in st.session_state.text_elements:
-                        x = element['actual_x']
-                        y = element['actual_y']
-                        
-                        # Use default font for preview
-                        try:
-                            font = ImageFont.truetype("arial.ttf", element['font_size'])
-                        except:
-                            try:
-                                font = ImageFont.truetype("Arial.ttf", element['font_size'])
-                            except:
-                                font = ImageFont.load_default()
-                        
-                        # Draw text
-                        draw.text((x, y), element['field'], fill=element['color'], font=font, anchor="mm")
-                    
-                    # Convert to base64 for the canvas
-                    img_buffer = io.BytesIO()
-                    image.save(img_buffer, format="PNG")
-                    img_data = base64.b64encode(img_buffer.getvalue()).decode("utf-8")
-                    
-                    # Show preview with interactive canvas
-                    st.markdown("### Drag fields to position them on the certificate")
-                    
-                    # Create an empty container for receiving dragged element data
-                    drag_receiver = st.empty()
-                    
-                    # Create interactive canvas with HTML/JS
-                    canvas_html = f"""
-                    <div style="position: relative; margin-bottom: 20px;">
-                        <img src="data:image/png;base64,{img_data}" style="width: 100%; max-width: 800px;" id="certificate-img">
-                        <div id="canvas-container" style="position: absolute; top: 0; left: 0; width: 100%; height: 100%;">
-                            <!-- Elements will be dynamically added here -->
-                        </div>
-                    </div>
-                    
-                    <script>
-                    // Wait for the image to load
-                    document.getElementById('certificate-img').onload = function() {{
-                        const container = document.getElementById('canvas-container');
-                        container.style.width = this.offsetWidth + 'px';
-                        container.style.height = this.offsetHeight + 'px';
-                        
-                        // Get current elements from JSON
-                        const elements = {json.dumps(st.session_state.text_elements)};
-                        const imageWidth = {st.session_state.template_size[0]};
-                        const imageHeight = {st.session_state.template_size[1]};
-                        const displayWidth = this.offsetWidth;
-                        const displayHeight = this.offsetHeight;
-                        
-                        // Scale factors
-                        const scaleX = displayWidth / imageWidth;
-                        const scaleY = displayHeight / imageHeight;
-                        
-                        // Function to update Streamlit
-                        function updateStreamlit(data) {{
-                            const hiddenInput = document.createElement('input');
-                            hiddenInput.type = 'text';
-                            hiddenInput.id = 'drag-data-input';
-                            hiddenInput.style.position = 'absolute';
-                            hiddenInput.style.visibility = 'hidden';
-                            hiddenInput.value = JSON.stringify(data);
-                            
-                            // Create a form to submit the data
-                            const form = document.createElement('form');
-                            form.method = 'POST';
-                            form.appendChild(hiddenInput);
-                            
-                            // Add the form to body and submit
-                            document.body.appendChild(form);
-                            
-                            // Create a submit button and click it
-                            const submitBtn = document.createElement('input');
-                            submitBtn.type = 'submit';
-                            form.appendChild(submitBtn);
-                            submitBtn.click();
-                            
-                            // Remove the form after submission
-                            setTimeout(() => form.remove(), 100);
-                        }}
-                        
-                        // Add each element
-                        elements.forEach((el) => {{
-                            // Create draggable div
-                            const elem = document.createElement('div');
-                            elem.id = 'element-' + el.id;
-                            elem.className = 'draggable-element';
-                            elem.style.position = 'absolute';
-                            elem.style.cursor = 'move';
-                            elem.style.backgroundColor = 'rgba(255,255,255,0.3)';
-                            elem.style.border = '1px dashed #333';
-                            elem.style.padding = '5px';
-                            elem.style.borderRadius = '4px';
-                            elem.style.fontSize = Math.max(10, el.font_size * scaleY * 0.8) + 'px';
-                            elem.style.color = el.color;
-                            
-                            // Calculate element width and height in display scale
-                            const elemWidth = el.width * scaleX;
-                            const elemHeight = el.height * scaleY;
-                            
-                            // Position the element (center-based)
-                            const left = (el.x_pos * displayWidth / 100) - (elemWidth / 2);
-                            const top = (el.y_pos * displayHeight / 100) - (elemHeight / 2);
-                            
-                            elem.style.left = left + 'px';
-                            elem.style.top = top + 'px';
-                            elem.style.minWidth = '50px';
-                            elem.style.textAlign = 'center';
-                            elem.innerHTML = el.field;
-                            
-                            // Add element to container
-                            container.appendChild(elem);
-                            
-                            // Make draggable
-                            let isDragging = false;
-                            let offsetX, offsetY;
-                            
-                            elem.addEventListener('mousedown', function(e) {{
-                                isDragging = true;
-                                offsetX = e.clientX - this.getBoundingClientRect().left;
-                                offsetY = e.clientY - this.getBoundingClientRect().top;
-                                this.style.zIndex = 1000;
-                                e.preventDefault(); // Prevent text selection
-                            }});
-                            
-                            document.addEventListener('mousemove', function(e) {{
-                                if (!isDragging) return;
-                                
-                                // Calculate new position
-                                const containerRect = container.getBoundingClientRect();
-                                const x = e.clientX - offsetX - containerRect.left;
-                                const y = e.clientY - offsetY - containerRect.top;
-                                
-                                // Keep within bounds
-                                const boundedX = Math.max(0, Math.min(container.offsetWidth - 50, x));
-                                const boundedY = Math.max(0, Math.min(container.offsetHeight - 20, y));
-                                
-                                elem.style.left = boundedX + 'px';
-                                elem.style.top = boundedY + 'px';
-                            }});
-                            
-                            document.addEventListener('mouseup', function() {{
-                                if (isDragging) {{
-                                    isDragging = false;
-                                    elem.style.zIndex = 'auto';
-                                    
-                                    // Calculate center position of the element
-                                    const elemRect = elem.getBoundingClientRect();
-                                    const containerRect = container.getBoundingClientRect();
-                                    
-                                    // Calculate center of element in container coordinates
-                                    const centerX = (elemRect.left - containerRect.left) + (elemRect.width / 2);
-                                    const centerY = (elemRect.top - containerRect.top) + (elemRect.height / 2);
-                                    
-                                    // Convert to percentage
-                                    const xPos = Math.round((centerX / container.offsetWidth) * 100);
-                                    const yPos = Math.round((centerY / container.offsetHeight) * 100);
-                                    
-                                    // Send update to Streamlit
-                                    updateStreamlit({{
-                                        elementId: el.id,
-                                        xPos: xPos,
-                                        yPos: yPos
-                                    }});
-                                }}
-                            }});
-                        }});
-                    }};
-                    </script>
-                    """
-                    
-                    st.components.v1.html(canvas_html, height=600)
-                    
-                    # Check if form was submitted with drag data
-                    if "drag-data-input" in st.query_params:
-                        try:
-                            drag_data = st.query_params["drag-data-input"]
-                            st.session_state.drag_update_data = drag_data
-                            st.rerun()
-                        except Exception as e:
-                            st.session_state.errors.append(f"Error handling drag update: {str(e)}")
-                        
-                except Exception as e:
-                    error_msg = f"Error generating preview: {str(e)}"
-                    st.session_state.errors.append(error_msg)
-                    st.error(error_msg)
+                design_preview()
             else:
                 st.info("Please upload a template image in the previous tab")
         
@@ -612,120 +608,188 @@ with tabs[2]:
     if not st.session_state.get('template_size') or not st.session_state.excel_headers or not st.session_state.text_elements:
         st.warning("⚠️ Please complete the previous steps first")
     else:
-        # Generate button
-        if st.button("🎓 GENERATE CERTIFICATES", type="primary", use_container_width=True, key="generate_certificates"):
-            with st.spinner("Generating certificates..."):
+        # Parallel rendering
+        render_workers = st.number_input(
+            "Render worker processes",
+            min_value=1,
+            max_value=os.cpu_count() or 1,
+            value=os.cpu_count() or 1,
+            key="render_workers",
+            help="Rows are split across this many processes. Use 1 to render serially."
+        )
+        
+        reuse_unchanged = st.checkbox(
+            "Only re-render changed certificates",
+            value=True,
+            key="reuse_unchanged",
+            help="Certificates whose template, layout and row values are unchanged are reused from the render cache."
+        )
+        
+        # Output profile
+        col_format, col_merged = st.columns(2)
+        with col_format:
+            output_profile = st.selectbox(
+                "Output profile",
+                options=certificate_engine.available_profiles(),
+                format_func=lambda profile: PROFILE_LABELS[profile],
+                key="output_profile_select",
+                help="Also used for QR-stamped and personalized certificates."
+            )
+        with col_merged:
+            merged_pdf = st.checkbox(
+                "Also build one merged PDF for printing",
+                value=False,
+                key="merged_pdf_checkbox",
+                disabled=not pdf_output.available(),
+                help="Every certificate as a page of a single PDF, with the template stored once."
+                     + ("" if pdf_output.available() else " Install 'reportlab' to enable it.")
+            )
+        
+        # Validation QR codes are stamped while rendering, before each certificate is encoded
+        col_qr, col_qr_url = st.columns(2)
+        with col_qr:
+            stamp_qr_codes = st.checkbox(
+                "Stamp a validation QR code on every certificate",
+                value=False,
+                key="qr_stage_checkbox",
+                help="Adds a QR code in the bottom-right corner in the same rendering pass."
+            )
+        with col_qr_url:
+            qr_url = st.text_input(
+                "Validation URL",
+                value=qr_stamp.QR_URL,
+                key="qr_url",
+                help="{cert_id} is replaced by each certificate's ID."
+            )
+        qr_url_valid = "{cert_id}" in qr_url
+        if not qr_url_valid:
+            st.warning("The validation URL must contain {cert_id}.")
+        event_name = st.text_input(
+            "Event name",
+            value="",
+            key="event_name",
+            help="Certificate IDs are derived from the event and each participant's row, so "
+                 "regenerating gives the same IDs. Leave empty to use the template."
+        )
+        
+        # Encode one sample certificate with every profile to compare CPU cost and size
+        with st.expander("Compare output profiles"):
+            if st.button("Measure with the first participant", key="measure_profiles"):
                 try:
-                    # Load template and Excel
-                    template_image = Image.open(st.session_state.template_file)
-                    df = st.session_state.excel_df
-                    
-                    if df is None:
-                        st.error("Excel data not found. Please go back to the first tab and upload it again.")
+                    sample = next(participant_records(st.session_state.text_elements), None)
+                    if sample is None:
+                        st.warning("The participant list has no rows to measure with.")
                     else:
-                        # Create temporary directory
-                        temp_dir = tempfile.mkdtemp()
-                        
-                        # Create a zip file in memory
-                        zip_buffer = io.BytesIO()
-                        with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-                            # Generate each certificate
-                            certificate_count = 0
-                            cert_files = {}
-                            st.session_state.email_sent_status = {}  # Reset sent status
-                            
-                            # Progress bar
-                            progress_bar = st.progress(0)
-                            total_rows = len(df)
-                            
-                            for idx, row in df.iterrows():
-                                # Update progress
-                                progress_percent = min(int((idx+1) / total_rows * 100), 100)
-                                progress_bar.progress(progress_percent)
-                                
-                                # Skip empty rows
-                                if row.isnull().all():
-                                    continue
-                                    
-                                # Create a copy of the template
-                                certificate = template_image.copy()
-                                draw = ImageDraw.Draw(certificate)
-                                
-                                # Add all fields
-                                for element in st.session_state.text_elements:
-                                    field_name = element['field']
-                                    if field_name in df.columns:
-                                        text = str(row[field_name]) if pd.notna(row[field_name]) else ""
-                                        
-                                        # Use best available font
-                                        try:
-                                            font = ImageFont.truetype("arial.ttf", element['font_size'])
-                                        except:
-                                            try:
-                                                font = ImageFont.truetype("Arial.ttf", element['font_size'])
-                                            except:
-                                                font = ImageFont.load_default()
-                                        
-                                        # Draw text
-                                        draw.text(
-                                            (element['actual_x'], element['actual_y']),
-                                            text,
-                                            fill=element['color'],
-                                            font=font,
-                                            anchor="mm"
-                                        )
-                                
-                                # Save the certificate
-                                filename = f"certificate_{idx+1}.png"
-                                
-                                # Use name if available (assume first column is name)
-                                if pd.notna(row[0]):
-                                    name = str(row[0]).replace(" ", "_")
-                                    filename = f"{name}_certificate.png"
-                                
-                                # Save to temporary file
-                                cert_path = os.path.join(temp_dir, filename)
-                                certificate.save(cert_path)
-                                
-                                # Add to zip
-                                zip_file.write(cert_path, filename)
-                                
-                                # Store for email
-                                if 'email_column' in st.session_state:
-                                    email = row[st.session_state.email_column] if st.session_state.email_column in row and pd.notna(row[st.session_state.email_column]) else None
-                                    if email and is_valid_email(email):
-                                        cert_files[email] = cert_path
-                                        st.session_state.email_sent_status[email] = False  # Initialize as not sent
-                                
-                                certificate_count += 1
-                            
-                            st.session_state.certificate_files = cert_files
-                        
-                        # Complete the progress bar
-                        progress_bar.progress(100)
-                        
-                        # Prepare download link
-                        zip_buffer.seek(0)
-                        b64 = base64.b64encode(zip_buffer.read()).decode()
-                        href = f'<a href="data:application/zip;base64,{b64}" download="certificates.zip" class="download-button">📥 Download All Certificates</a>'
-                        
-                        # Success message
-                        st.success(f"✅ Successfully generated {certificate_count} certificates!")
-                        st.markdown(href, unsafe_allow_html=True)
-                        
-                        # Set flag for email section
-                        st.session_state.certificates_generated = True  # Ensure this is set
-
+                        measurements = certificate_engine.measure_profiles(
+                            get_template_raster(),
+                            st.session_state.text_elements,
+                            sample['texts']
+                        )
+                        st.dataframe(pd.DataFrame([
+                            {
+                                'Profile': PROFILE_LABELS[m['profile']],
+                                'Encode time (ms)': round(m['seconds'] * 1000, 1),
+                                'Size (KB)': round(m['bytes'] / 1024, 1),
+                            }
+                            for m in measurements
+                        ]), use_container_width=True, hide_index=True)
                 except Exception as e:
-                    error_msg = f"Error generating certificates: {str(e)}"
-                    st.session_state.errors.append(error_msg)
-                    st.error(error_msg)
+                    st.error(f"Error measuring output profiles: {str(e)}")
+        
+        # Generate button
+        if st.button("🎓 GENERATE CERTIFICATES", type="primary", use_container_width=True, key="generate_certificates"):
+            try:
+                if st.session_state.participant_file is None:
+                    st.error("Excel data not found. Please go back to the first tab and upload it again.")
+                elif stamp_qr_codes and not qr_url_valid:
+                    st.error("Please fix the validation URL before generating with QR codes.")
+                else:
+                    # Queue the job; a background worker renders it and survives reruns and restarts.
+                    # Reading the participant file is timed as the job's ingest stage.
+                    job_id = uuid.uuid4().hex
+                    records = job_runner.metrics_for(job_id).timed(participant_records(
+                        st.session_state.text_elements,
+                        st.session_state.get('email_column'),
+                        output_profile
+                    ), "ingest")
+                    job_id = submit_generation(
+                        job_store,
+                        st.session_state.template_file,
+                        st.session_state.text_elements,
+                        records,
+                        workers=render_workers,
+                        cache_dir=certificate_engine.CACHE_DIR if reuse_unchanged else None,
+                        profile=output_profile,
+                        merged_pdf=merged_pdf,
+                        qr_url=qr_url if stamp_qr_codes else None,
+                        event=event_name or None,
+                        job_id=job_id
+                    )
+                    st.session_state.generation_job = job_id
+                    st.query_params['generation_job'] = job_id
+                    st.session_state.pop('email_job', None)
+                    st.query_params.pop('email_job', None)
+            except Exception as e:
+                error_msg = f"Error generating certificates: {str(e)}"
+                st.session_state.errors.append(error_msg)
+                st.error(error_msg)
+        
+        # Show progress and results of the current generation job
+        if st.session_state.get('generation_job'):
+            generation_job = job_store.get_job(st.session_state.generation_job)
+            if generation_job and generation_job['status'] not in FINISHED_STATUSES:
+                generation_job = wait_for_job(generation_job['id'], "Generating certificates...")
+            
+            if generation_job is None:
+                # The job expired and its files were cleaned up
+                st.session_state.pop('generation_job', None)
+                st.query_params.pop('generation_job', None)
+                if st.session_state.pop('loaded_generation_job', None):
+                    st.session_state.certificate_files = {}
+                    st.session_state.certificates_generated = False
+                    st.info("Those certificates have expired; generate them again.")
+            elif generation_job['status'] == "failed":
+                error_msg = f"Error generating certificates: {generation_job['error']}"
+                st.error(error_msg)
+            else:
+                if st.session_state.get('loaded_generation_job') != generation_job['id']:
+                    load_generation_results(generation_job)
+                
+                # Success message
+                st.success(f"✅ Successfully generated {st.session_state.certificate_count} certificates!")
+                
+                # Serve the archive from disk (read only when clicked) instead of an inline data URI
+                st.download_button(
+                    "📥 Download All Certificates",
+                    data=partial(read_file_bytes, st.session_state.certificates_zip),
+                    file_name="certificates.zip",
+                    mime="application/zip",
+                    key="download_certificates_zip"
+                )
+                if st.session_state.get('merged_pdf'):
+                    st.download_button(
+                        "🖨️ Download Merged PDF for Printing",
+                        data=partial(read_file_bytes, st.session_state.merged_pdf),
+                        file_name="certificates.pdf",
+                        mime="application/pdf",
+                        key="download_merged_pdf"
+                    )
+
+        # Export the layout so the same batch can be rendered headlessly
+        st.download_button(
+            "Export Layout (JSON)",
+            data=certificate_engine.dump_layout(st.session_state.text_elements),
+            file_name="layout.json",
+            mime="application/json",
+            help="Use with `python certificate_engine.py --layout layout.json ...` to render without the browser",
+            key="export_layout"
+        )
 
         # Email section
         if 'email_column' in st.session_state and st.session_state.certificates_generated:
             st.header("Send Certificates by Email")
             
-            if not st.session_state.get('sender_email') or not st.session_state.get('email_password'):
+            if not email_configured():
                 st.warning("⚠️ Please enter your email credentials in the first tab to send emails")
             else:
                 # Email settings
@@ -750,6 +814,18 @@ Certificate Team""",
                                               key="test_email_input",
                                               help="Send a test email to verify your configuration")
                     
+                    # Sending speed
+                    st.markdown("**Sending speed** (set limits to match your provider's quota, 0 = no limit)")
+                    speed_a, speed_b, speed_c, speed_d = st.columns(4)
+                    with speed_a:
+                        send_workers = st.number_input("Parallel connections", min_value=1, max_value=20, value=4, key="send_workers")
+                    with speed_b:
+                        rate_per_second = st.number_input("Emails / second", min_value=0, value=5, key="rate_per_second")
+                    with speed_c:
+                        rate_per_minute = st.number_input("Emails / minute", min_value=0, value=0, key="rate_per_minute")
+                    with speed_d:
+                        rate_per_day = st.number_input("Emails / day", min_value=0, value=0, key="rate_per_day")
+                    
                     col1, col2 = st.columns(2)
                     with col1:
                         test_submit = st.form_submit_button("Send Test Email")
@@ -763,24 +839,20 @@ Certificate Team""",
                     else:
                         # Try sending test email
                         with st.spinner("Sending test email..."):
+                            # A private directory per test send, removed afterwards, so concurrent
+                            # sessions never overwrite each other's sample and nothing piles up
+                            test_dir = tempfile.TemporaryDirectory(prefix="test_certificate_")
                             try:
                                 # Create test certificate
                                 test_cert_path = None
                                 if st.session_state.template_file:
                                     # Generate simple test certificate
-                                    template_image = Image.open(st.session_state.template_file)
-                                    test_cert = template_image.copy()
+                                    test_cert = get_template_raster().copy()
                                     draw = ImageDraw.Draw(test_cert)
                                     
                                     # Add test text
                                     for element in st.session_state.text_elements:
-                                        try:
-                                            font = ImageFont.truetype("arial.ttf", element['font_size'])
-                                        except:
-                                            try:
-                                                font = ImageFont.truetype("Arial.ttf", element['font_size'])
-                                            except:
-                                                font = ImageFont.load_default()
+                                        font = get_font(element['font_size'], element.get('font'))
                                         
                                         draw.text(
                                             (element['actual_x'], element['actual_y']),
@@ -791,7 +863,7 @@ Certificate Team""",
                                         )
                                     
                                     # Save test certificate
-                                    test_cert_path = os.path.join(tempfile.gettempdir(), "test_certificate.png")
+                                    test_cert_path = os.path.join(test_dir.name, "test_certificate.png")
                                     test_cert.save(test_cert_path)
                                 
                                 # Send test email
@@ -801,7 +873,8 @@ Certificate Team""",
                                     test_email,
                                     subject,
                                     email_body,
-                                    test_cert_path
+                                    test_cert_path,
+                                    settings=st.session_state.smtp_settings
                                 )
                                 
                                 if success:
@@ -814,74 +887,72 @@ Certificate Team""",
                                 error_msg = f"Error sending test email: {str(e)}"
                                 st.session_state.errors.append(error_msg)
                                 st.error(error_msg)
+                            finally:
+                                test_dir.cleanup()
                 
                 # Process all emails
                 if submit_all:
                     if not st.session_state.certificate_files:
                         st.error("No certificates generated yet or no valid email addresses found")
                     else:
-                        # Send emails
-                        with st.spinner(f"Sending {len(st.session_state.certificate_files)} emails..."):
-                            try:
-                                # Progress bar
-                                progress_bar = st.progress(0)
-                                sent_count = 0
-                                failed_emails = []
-                                EMAIL_SEND_DELAY = 1  # seconds between emails
-                                
-                                for idx, (email, cert_path) in enumerate(st.session_state.certificate_files.items()):
-                                    try:
-                                        # Skip if already sent
-                                        if st.session_state.email_sent_status.get(email, False):
-                                            continue
-                                            
-                                        # Update progress
-                                        progress_percent = min(int((idx+1) / len(st.session_state.certificate_files) * 100), 100)
-                                        progress_bar.progress(progress_percent)
-                                        
-                                        if not is_valid_email(email):
-                                            failed_emails.append((email, "Invalid email format"))
-                                            continue
-                                            
-                                        # Send email with certificate
-                                        success, message = send_email(
-                                            st.session_state.sender_email,
-                                            st.session_state.email_password,
-                                            email,
-                                            subject,
-                                            email_body,
-                                            cert_path
-                                        )
-                                        
-                                        if success:
-                                            sent_count += 1
-                                            st.session_state.email_sent_status[email] = True
-                                        else:
-                                            failed_emails.append((email, message))
-                                        
-                                        # Prevent rate limiting
-                                        if idx < len(st.session_state.certificate_files) - 1:
-                                            time.sleep(EMAIL_SEND_DELAY)
-                                        
-                                    except Exception as e:
-                                        failed_emails.append((email, str(e)))
-                                
-                                # Complete progress bar
-                                progress_bar.progress(100)
-                                
-                                # Log failed emails
-                                if failed_emails:
-                                    st.warning(f"✅ Sent {sent_count} out of {len(st.session_state.certificate_files)} emails. {len(failed_emails)} failed.")
-                                    with st.expander("Failed Emails"):
-                                        for email, error in failed_emails:
-                                            st.write(f"- {email}: {error}")
-                                else:
-                                    st.success(f"✅ Successfully sent all {sent_count} emails!")
-                                
-                            except Exception as e:
-                                error_msg = f"Error sending emails: {str(e)}"
-                                st.session_state.errors.append(error_msg)
-                                st.error(error_msg)
+                        try:
+                            # Only send to recipients that have not received their certificate yet
+                            pending = [
+                                (email, cert_path)
+                                for email, cert_path in st.session_state.certificate_files.items()
+                                if not st.session_state.email_sent_status.get(email, False)
+                            ]
+                            
+                            # Queue the job; it sends concurrently over pooled connections, paced by the rate limits
+                            job_id = job_runner.submit_email(
+                                st.session_state.email_password,
+                                st.session_state.sender_email,
+                                st.session_state.smtp_settings,
+                                subject,
+                                email_body,
+                                pending,
+                                workers=send_workers,
+                                per_second=rate_per_second or None,
+                                per_minute=rate_per_minute or None,
+                                per_day=rate_per_day or None,
+                                source_job=st.session_state.get('loaded_generation_job')
+                            )
+                            st.session_state.email_job = job_id
+                            st.query_params['email_job'] = job_id
+                        except Exception as e:
+                            error_msg = f"Error sending emails: {str(e)}"
+                            st.session_state.errors.append(error_msg)
+                            st.error(error_msg)
+                
+                # Show progress and results of the current email job
+                if st.session_state.get('email_job'):
+                    email_job = job_store.get_job(st.session_state.email_job)
+                    if email_job and email_job['status'] not in FINISHED_STATUSES:
+                        email_job = wait_for_job(email_job['id'], "Sending emails...")
+                    
+                    if email_job is None:
+                        st.session_state.pop('email_job', None)
+                    elif email_job['status'] == "paused":
+                        st.warning(email_job['error'])
+                        if st.button("Resume Sending", key="resume_email_job"):
+                            job_runner.resume(email_job['id'], st.session_state.email_password)
+                            st.rerun()
+                    elif email_job['status'] == "failed":
+                        error_msg = f"Error sending emails: {email_job['error']}"
+                        st.error(error_msg)
+                    else:
+                        failed_emails = load_email_results(email_job)
+                        counts = job_store.row_counts(email_job['id'])
+                        sent_count = counts.get('done', 0)
+                        
+                        # Log failed emails
+                        if failed_emails:
+                            st.warning(f"✅ Sent {sent_count} out of {sum(counts.values())} emails. {len(failed_emails)} failed.")
+                            with st.expander("Failed Emails"):
+                                for email, error in failed_emails:
+                                    st.write(f"- {email}: {error}")
+                        else:
+                            st.success(f"✅ Successfully sent all {sent_count} emails!")
 
         # Navigation
         if st.button("⬅️ Back to Design", use_container_width=True, key="back_to_design"):
@@ -930,89 +1001,163 @@ with tabs[3]:
                     failed_emails_list = [
                         email for email, status in st.session_state.email_sent_status.items() if not status
                     ]
-                    for email in failed_emails_list:
-                        cert_path = st.session_state.certificate_files.get(email)
-                        if cert_path:
-                            success, message = send_email(
-                                st.session_state.sender_email,
-                                st.session_state.email_password,
-                                email,
-                                "Your Certificate",
-                                "Please find your certificate attached.",
-                                cert_path
-                            )
-                            if success:
-                                st.session_state.email_sent_status[email] = True
-                            else:
-                                st.error(f"Failed to send email to {email}: {message}")
+                    with SMTPMailer(st.session_state.sender_email,
+                                    st.session_state.email_password,
+                                    settings=st.session_state.smtp_settings) as mailer:
+                        for email in failed_emails_list:
+                            cert_path = st.session_state.certificate_files.get(email)
+                            if cert_path:
+                                success, message = send_email(
+                                    st.session_state.sender_email,
+                                    st.session_state.email_password,
+                                    email,
+                                    "Your Certificate",
+                                    "Please find your certificate attached.",
+                                    cert_path,
+                                    mailer=mailer
+                                )
+                                if success:
+                                    st.session_state.email_sent_status[email] = True
+                                else:
+                                    st.error(f"Failed to send email to {email}: {message}")
                     st.success("Retry process completed.")
 
+    # Where this session's jobs spent their time, exportable for dashboards
+    tracked_jobs = [
+        (label, job_store.get_job(st.session_state[job_key]))
+        for label, job_key in (("Generation", 'generation_job'), ("Email", 'email_job'), ("QR codes", 'qr_job'))
+        if st.session_state.get(job_key)
+    ]
+    tracked_jobs = [(label, job) for label, job in tracked_jobs if job and job_metrics_summary(job)]
+    if tracked_jobs:
+        st.subheader("Pipeline Performance")
+        for label, job in tracked_jobs:
+            summary = job_metrics_summary(job)
+            st.markdown(f"**{label}** ({job['status']})")
+            show_pipeline_metrics(summary)
+            col_json, col_prom = st.columns(2)
+            with col_json:
+                st.download_button(
+                    "Export JSON",
+                    data=metrics.to_json(summary),
+                    file_name=f"{job['kind']}-{job['id']}-metrics.json",
+                    mime="application/json",
+                    key=f"metrics_json_{job['id']}"
+                )
+            with col_prom:
+                st.download_button(
+                    "Export Prometheus",
+                    data=metrics.to_prometheus(summary, {'job': job['id'], 'kind': job['kind']}),
+                    file_name=f"{job['kind']}-{job['id']}-metrics.prom",
+                    mime="text/plain",
+                    key=f"metrics_prom_{job['id']}"
+                )
+
 # Tab 6: QR Code Validation
 with tabs[4]:
     st.header("QR Code Validation")
 
-    # Define folder to save certificates with QR codes
-    qr_cert_folder = "certificates_with_qr/"
-    if not os.path.exists(qr_cert_folder):
-        os.makedirs(qr_cert_folder)  # Create folder if it doesn't exist
-
     # Generate QR codes for existing certificates
     st.subheader("Generate QR Codes for Certificates")
     if st.session_state.get('certificate_files', {}):
+        if st.session_state.get('qr_stage_checkbox'):
+            st.info("Certificates generated with \"Stamp a validation QR code\" already carry their QR codes.")
         if st.button("Generate QR Codes", key="generate_qr_codes_button"):
-            with st.spinner("Generating QR codes for certificates..."):
+            qr_url = st.session_state.get('qr_url', qr_stamp.QR_URL)
+            if "{cert_id}" not in qr_url:
+                st.error("The validation URL in the Generate & Send tab must contain {cert_id}.")
+            else:
                 try:
-                    for email, cert_path in st.session_state.certificate_files.items():
-                        # Load the certificate
-                        certificate = Image.open(cert_path)
-                        draw = ImageDraw.Draw(certificate)
-
-                        # Generate a unique QR code
-                        certificate_id = f"cert_{uuid.uuid4()}"
-                        qr_data = f"https://your-validation-url.com/validate?cert_id={certificate_id}"
-                        qr_code = qrcode.make(qr_data)
-
-                        # Resize and paste the QR code onto the certificate
-                        qr_code_size = (150, 150)  # Adjust size as needed
-                        qr_code = qr_code.resize(qr_code_size)
-                        certificate.paste(qr_code, (certificate.width - 160, certificate.height - 160))  # Adjust position
-
-                        # Save the updated certificate with QR code
-                        qr_cert_path = os.path.join(qr_cert_folder, os.path.basename(cert_path))
-                        certificate.save(qr_cert_path)
-
-                    st.success("QR codes generated and added to certificates successfully!")
+                    # Render every certificate again with its QR code in one pass, as a background
+                    # job writing into its own directory, instead of re-encoding the finished files
+                    output_profile = st.session_state.get('output_profile_select', certificate_engine.DEFAULT_PROFILE)
+                    job_id = uuid.uuid4().hex
+                    records = job_runner.metrics_for(job_id).timed(participant_records(
+                        st.session_state.text_elements,
+                        st.session_state.get('email_column'),
+                        output_profile
+                    ), "ingest")
+                    job_id = submit_generation(
+                        job_store,
+                        st.session_state.template_file,
+                        st.session_state.text_elements,
+                        records,
+                        workers=st.session_state.get('render_workers', 1),
+                        profile=output_profile,
+                        qr_url=qr_url,
+                        event=st.session_state.get('event_name') or None,
+                        job_id=job_id
+                    )
+                    st.session_state.qr_job = job_id
+                    st.query_params['qr_job'] = job_id
                 except Exception as e:
                     st.error(f"Error generating QR codes: {str(e)}")
     else:
         st.info("No certificates found. Please generate certificates first in Tab 3.")
 
+    # Follow this session's QR job; finished jobs expire with the rest of the jobs directory
+    qr_job = None
+    if st.session_state.get('qr_job'):
+        qr_job = job_store.get_job(st.session_state.qr_job)
+        if qr_job and qr_job['status'] not in FINISHED_STATUSES:
+            qr_job = wait_for_job(qr_job['id'], "Generating QR codes for certificates...")
+        if qr_job is None:
+            st.session_state.pop('qr_job', None)
+            st.query_params.pop('qr_job', None)
+            st.info("Those certificates with QR codes have expired; generate them again.")
+        elif qr_job['status'] == "failed":
+            st.error(f"Error generating QR codes: {qr_job['error']}")
+            qr_job = None
+        else:
+            st.success("QR codes generated and added to certificates successfully!")
+
     # Preview certificates with QR codes
     st.subheader("Preview Certificates with QR Codes")
-    qr_certificates = [f for f in os.listdir(qr_cert_folder) if f.endswith(('.png', '.jpg', '.jpeg'))]
-    if qr_certificates:
-        selected_qr_cert = st.selectbox("Select a certificate to preview", qr_certificates, key="preview_qr_cert_select")
+    qr_certificates = job_certificate_paths(qr_job['id'], qr_job['updated_at']) if qr_job else {}
+    qr_previews = [f for f in qr_certificates if not f.endswith('.pdf')]
+    if qr_previews:
+        selected_qr_cert = st.selectbox("Select a certificate to preview", qr_previews, key="preview_qr_cert_select")
         if selected_qr_cert:
-            qr_cert_path = os.path.join(qr_cert_folder, selected_qr_cert)
-            st.image(qr_cert_path, caption=f"Preview: {selected_qr_cert}")
+            st.image(qr_certificates[selected_qr_cert], caption=f"Preview: {selected_qr_cert}")
+    elif qr_certificates:
+        st.info("PDF certificates can't be previewed here; download them below.")
     else:
         st.info("No certificates with QR codes found. Generate QR codes first.")
 
-    # Download certificates with QR codes
+    # Download certificates with QR codes. The job zips them once when stamping finishes
+    # (a new job means a new archive), and the file is only read when the button is clicked.
     st.subheader("Download Certificates with QR Codes")
-    if qr_certificates:
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-            for qr_cert in qr_certificates:
-                qr_cert_path = os.path.join(qr_cert_folder, qr_cert)
-                zip_file.write(qr_cert_path, qr_cert)
-        zip_buffer.seek(0)
-        b64 = base64.b64encode(zip_buffer.read()).decode()
-        href = f'<a href="data:application/zip;base64,{b64}" download="certificates_with_qr.zip" class="download-button">📥 Download All Certificates with QR Codes</a>'
-        st.markdown(href, unsafe_allow_html=True)
+    qr_zip_path = qr_job['result']['zip_path'] if qr_job else None
+    if qr_certificates and os.path.exists(qr_zip_path):
+        st.caption(f"{qr_job['result']['count']} certificates, {os.path.getsize(qr_zip_path) / 1048576:.1f} MB")
+        st.download_button(
+            "📥 Download All Certificates with QR Codes",
+            data=partial(read_file_bytes, qr_zip_path),
+            file_name="certificates_with_qr.zip",
+            mime="application/zip",
+            key="download_qr_zip"
+        )
     else:
         st.info("No certificates with QR codes available for download.")
 
+    # Look a scanned code up in the local registry of issued certificates
+    st.subheader("Verify a Certificate")
+    scanned_code = st.text_input("Certificate ID or scanned QR link", key="verify_certificate_input")
+    if scanned_code:
+        verification = CertificateRegistry().verify(scanned_code)
+        if verification['valid']:
+            issued = verification['record']
+            st.success(f"Valid certificate {verification['certificate_id']}")
+            st.json({
+                'Participant': issued['participant'],
+                'Event': issued['event'],
+                'File': issued['filename'],
+                'SHA-256': issued['image_sha256'],
+                'Issued': time.strftime("%Y-%m-%d %H:%M", time.localtime(issued['issued_at'])),
+            })
+        else:
+            st.error(f"No certificate with ID {verification['certificate_id']} has been issued.")
+
 # Add custom CSS for better styling
 st.markdown("""
 <style>
@@ -1046,11 +1191,6 @@ st.markdown("""
         padding-top: 2rem;
     }
     
-    /* Fix for drag-and-drop elements */
-    .draggable-element:hover {
-        background-color: rgba(255,255,255,0.5) !important;
-    }
-    
     /* Better form elements */
     .stTextInput input, .stTextArea textarea {
         border: 1px solid #ddd !important;
@@ -1096,8 +1236,7 @@ with tabs[5]:  # Adjusted index to match the correct tab
     if st.session_state.get('template_file'):
         try:
             # Load the certificate template
-            template_image = Image.open(st.session_state.template_file)
-            certificate = template_image.copy()
+            certificate = get_template_raster().copy()
             draw = ImageDraw.Draw(certificate)
 
             # Add sliders for photo position (after certificate is defined)
@@ -1108,10 +1247,7 @@ with tabs[5]:  # Adjusted index to match the correct tab
             # Add participant name
             if participant_name.strip():
                 font_size = 48
-                try:
-                    font = ImageFont.truetype("arial.ttf", font_size)
-                except:
-                    font = ImageFont.load_default()
+                font = get_font(font_size)
                 
                 text_x = certificate.width // 2
                 text_y = certificate.height // 2
@@ -1120,10 +1256,7 @@ with tabs[5]:  # Adjusted index to match the correct tab
             # Add participant email
             if participant_email.strip():
                 font_size = 36
-                try:
-                    font = ImageFont.truetype("arial.ttf", font_size)
-                except:
-                    font = ImageFont.load_default()
+                font = get_font(font_size)
                 
                 text_x = certificate.width // 2
                 text_y = certificate.height // 2 + 60  # Adjust position below the name
@@ -1140,13 +1273,17 @@ with tabs[5]:  # Adjusted index to match the correct tab
 
             # Generate and download the certificate
             if st.button("Download Certificate", key="download_participant_certificate"):
+                profile = st.session_state.get('output_profile_select', certificate_engine.DEFAULT_PROFILE)
+                profile_settings = certificate_engine.OUTPUT_PROFILES[profile]
+                mime = profile_settings['mime']
+                extension = profile_settings['extension']
                 cert_buffer = io.BytesIO()
-                certificate.save(cert_buffer, format="PNG")
+                certificate_engine.save_image(certificate, cert_buffer, profile)
                 cert_buffer.seek(0)
 
                 # Provide download link
                 b64 = base64.b64encode(cert_buffer.read()).decode()
-                href = f'<a href="data:image/png;base64,{b64}" download="{participant_name}_certificate.png" class="download-button">📥 Download Your Certificate</a>'
+                href = f'<a href="data:{mime};base64,{b64}" download="{participant_name}_certificate.{extension}" class="download-button">📥 Download Your Certificate</a>'
                 st.markdown(href, unsafe_allow_html=True)
                 st.success("Your certificate has been generated successfully!")
         except Exception as e:
@@ -1154,16 +1291,33 @@ with tabs[5]:  # Adjusted index to match the correct tab
     else:
         st.error("No certificate template found. Please upload a template in Tab 1.")
         
-# Convert the image to Base64
-def get_base64_image(image_path):
-    with open(image_path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode()
+# Branding images are served from ./static (server.enableStaticServing in
+# .streamlit/config.toml) at twice their displayed width, instead of being
+# base64-inlined into the page on every rerun
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# Function to resize a branding image for static serving, once per process
+# The thumbnail is only rewritten when the source image is newer than it.
+@st.cache_resource
+def branding_asset(source, name, width):
+    source_path = os.path.join(os.path.dirname(STATIC_DIR), source)
+    target_path = os.path.join(STATIC_DIR, name)
+    if not os.path.exists(target_path) or os.path.getmtime(target_path) < os.path.getmtime(source_path):
+        try:
+            with Image.open(source_path) as image:
+                image.thumbnail((width, width * image.height // image.width), Image.Resampling.LANCZOS)
+                os.makedirs(STATIC_DIR, exist_ok=True)
+                image.save(target_path, optimize=True)
+        except OSError:
+            # Read-only deployments keep serving the committed thumbnail
+            pass
+    return f"app/static/{name}"
 
 # Embed the developer's picture and name at the bottom center
-image_base64 = get_base64_image("pic.png")
+developer_picture = branding_asset("pic.png", "developer.png", 120)
 st.markdown(f"""
     <div style="position: fixed; bottom: 40px; width: 100%; text-align: center; font-size: 15px; color: grey;">
-        <img src="data:image/jpeg;base64,{image_base64}" alt="Developer" style="width: 60px; height: 60px; border-radius: 50%; margin-bottom: 5px;">
+        <img src="{developer_picture}" alt="Developer" style="width: 60px; height: 60px; border-radius: 50%; margin-bottom: 5px;">
         <br>
         Developer: <strong>Abhishek Yadav</strong>
     </div>
@@ -1171,16 +1325,11 @@ st.markdown(f"""
 
 
 
-# Convert the logo image to Base64
-def get_base64_logo(image_path):
-    with open(image_path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode()
-
 # Embed the app logo at the top center
-logo_base64 = get_base64_logo("image.png")
+logo = branding_asset("image.png", "logo.png", 240)
 st.markdown(f"""
     <div style="text-align: center; margin-bottom: 20px;">
-        <img src="data:image/png;base64,{logo_base64}" alt="App Logo" style="width: 120px; height: auto; border-radius: 10px; box-shadow: 0px 4px 6px rgba(0, 0, 0, 0.1);">
+        <img src="{logo}" alt="App Logo" style="width: 120px; height: auto; border-radius: 10px; box-shadow: 0px 4px 6px rgba(0, 0, 0, 0.1);">
         <h1 style="margin-top: 10px; color: #1E88E5;">CertificateSaathi.AI</h1>
     </div>
 """, unsafe_allow_html=True)
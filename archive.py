@@ -0,0 +1,70 @@
+"""Streaming zip archive for rendered certificates.
+
+Certificates are appended to an on-disk zip as they are produced, so memory
+stays bounded no matter how many rows are rendered. Images are stored without
+re-compression because PNG/JPEG/WebP/PDF data is already compressed.
+"""
+import os
+import zipfile
+
+# Extensions whose payload is already compressed
+STORED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".pdf")
+
+
+class CertificateArchive:
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._names = set()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._zip = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Function to pick the compression for an entry from its extension
+    def _compression(self, arcname):
+        if arcname.lower().endswith(STORED_EXTENSIONS):
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    # Function to keep entry names unique (two participants can share a name)
+    def _unique_name(self, arcname):
+        if arcname not in self._names:
+            self._names.add(arcname)
+            return arcname
+        stem, ext = os.path.splitext(arcname)
+        counter = 2
+        while f"{stem}_{counter}{ext}" in self._names:
+            counter += 1
+        arcname = f"{stem}_{counter}{ext}"
+        self._names.add(arcname)
+        return arcname
+
+    # Function to append a file from disk; data is copied in chunks
+    def add_file(self, path, arcname=None):
+        arcname = self._unique_name(arcname or os.path.basename(path))
+        self._zip.write(path, arcname, compress_type=self._compression(arcname))
+        self.count += 1
+        return arcname
+
+    # Function to append in-memory bytes (e.g. an encoded image)
+    def add_bytes(self, data, arcname):
+        arcname = self._unique_name(arcname)
+        self._zip.writestr(arcname, data, compress_type=self._compression(arcname))
+        self.count += 1
+        return arcname
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
@@ -0,0 +1,356 @@
+"""Throughput benchmark for the certificate pipeline.
+
+Generates synthetic participant sheets and templates, times every stage of a
+run and prints the results as JSON, so rows/sec and MB/s can be tracked across
+changes:
+
+    python benchmark.py --rows 1000 10000 100000 --templates 720p a4-300dpi \
+        --output results.json
+    python benchmark.py --baseline results.json     # exit 1 on a regression
+
+Stages:
+    ingest    stream the participant file in chunks (ingest.py)
+    layout    turn rows into render records (prepare_records)
+    draw      copy the template and draw the text fields
+    encode    encode a drawn certificate with the profile's full-page encoder
+    render    write certificates the way a run does (overlay PNG, PDF, ...)
+    qr        the render stage with a QR code stamped in the same pass
+    zip       add certificates to a streaming archive
+    email     send certificates through SMTPMailer to a local SMTP sink
+    generate  end-to-end: render_batch with a process pool plus the zip
+
+ingest and layout run over the whole sheet for every row count. The
+per-certificate stages run on --sample rows for every template size, and
+generate runs for row counts up to --generate-limit.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+
+import certificate_engine
+import ingest
+import qr_stamp
+import registry
+from archive import CertificateArchive
+from fonts import get_font
+from mailer import EmailDispatcher, SMTPMailer, SMTPSettings
+from smtp_sink import LocalSMTPSink
+
+# Synthetic template sizes (landscape, like most certificates)
+TEMPLATE_SIZES = {
+    "720p": (1280, 720),
+    "a4-150dpi": (1754, 1240),
+    "a4-300dpi": (3508, 2480),
+}
+
+ROW_COUNTS = (1000, 10000, 100000)
+
+SAMPLE_ROWS = 100
+
+# End-to-end runs keep every certificate on disk until the zip is written, so
+# larger sheets are opt-in (a 300dpi A4 certificate is about 3 MB)
+GENERATE_LIMIT = 1000
+
+# A rise in seconds per row larger than this fraction counts as a regression
+REGRESSION_TOLERANCE = 0.15
+
+FIRST_NAMES = ("Aarav", "Diya", "Kabir", "Meera", "Rohan", "Sara", "Vihaan", "Zoya", "Arjun", "Ishita")
+LAST_NAMES = ("Sharma", "Verma", "Iyer", "Khan", "Patel", "Reddy", "Singh", "Das", "Mehta", "Nair")
+COURSES = ("Data Science Bootcamp", "Cloud Fundamentals", "Web Development", "Machine Learning 101")
+
+
+def _log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+# Function to build a template with a gradient, border, heading and paper-like texture
+# The texture keeps it from compressing unrealistically well: the PNG comes out at
+# about a third of a byte per pixel, like the sample template in this repository.
+def synthetic_template(width, height):
+    gradient = Image.linear_gradient("L").resize((width, height))
+    template = Image.merge("RGB", (
+        gradient.point(lambda value: 235 + value // 16),
+        Image.new("L", (width, height), 240),
+        gradient.point(lambda value: 250 - value // 8),
+    ))
+    texture = Image.effect_noise((max(1, width // 8), max(1, height // 8)), 24)
+    texture = texture.resize((width, height), Image.Resampling.BILINEAR).convert("RGB")
+    template = Image.blend(template, texture, 0.03)
+
+    draw = ImageDraw.Draw(template)
+    border = max(8, width // 60)
+    draw.rectangle((border, border, width - border, height - border), outline="#1E3A5F", width=border // 2)
+    draw.rectangle((border * 2, border * 2, width - border * 2, height - border * 2), outline="#C9A227",
+                   width=max(2, border // 6))
+    draw.text((width / 2, height * 0.2), "Certificate of Achievement", fill="#1E3A5F",
+              font=get_font(max(12, height // 12)), anchor="mm")
+    return template
+
+
+# Function to save a synthetic template as a PNG file, as an upload would arrive
+def write_template(path, width, height):
+    synthetic_template(width, height).save(path, format="PNG")
+    return path
+
+
+# Function to lay out the synthetic fields in template pixels
+def synthetic_layout(width, height):
+    return [
+        {'id': "name", 'field': "Name", 'font_size': max(12, height // 14), 'color': "#000000",
+         'x_pos': 50, 'y_pos': 45, 'actual_x': width * 0.5, 'actual_y': height * 0.45},
+        {'id': "course", 'field': "Course", 'font_size': max(10, height // 24), 'color': "#333333",
+         'x_pos': 50, 'y_pos': 60, 'actual_x': width * 0.5, 'actual_y': height * 0.6},
+    ]
+
+
+# Function to write a participant sheet with Name, Course and Email columns
+def write_participants(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Name", "Course", "Email"])
+        for i in range(rows):
+            first = FIRST_NAMES[i % len(FIRST_NAMES)]
+            last = LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]
+            writer.writerow([f"{first} {last} {i}", COURSES[i % len(COURSES)], f"participant{i}@example.com"])
+    return path
+
+
+# Function to turn a stage timing into a result entry
+def _result(stage, rows, seconds, nbytes=None, template=None):
+    return {
+        'stage': stage,
+        'template': template,
+        'rows': rows,
+        'seconds': round(seconds, 6),
+        'rows_per_sec': round(rows / seconds, 2) if seconds > 0 else None,
+        'bytes': nbytes,
+        'mb_per_sec': round(nbytes / 1e6 / seconds, 2) if nbytes and seconds > 0 else None,
+    }
+
+
+# Function to time ingest and layout over a whole participant sheet
+def bench_sheet(data_path, rows, text_elements, profile):
+    start = time.perf_counter()
+    chunks = list(ingest.iter_chunks(data_path, data_path))
+    ingest_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    records = []
+    taken_filenames = set()
+    for chunk in chunks:
+        records.extend(certificate_engine.prepare_records(chunk, text_elements, "Email", profile, taken_filenames))
+    layout_seconds = time.perf_counter() - start
+
+    return [
+        _result("ingest", rows, ingest_seconds, os.path.getsize(data_path)),
+        _result("layout", len(records), layout_seconds),
+    ]
+
+
+# Function to time the per-certificate stages on a sample of records
+def bench_certificates(name, template, text_elements, records, work_dir, profile):
+    results = []
+    template_image = certificate_engine.decode_template(template)
+    count = len(records)
+
+    # Draw and encode one certificate at a time; full-page rasters are too big to keep
+    draw_seconds = encode_seconds = 0.0
+    encoded_bytes = 0
+    for record in records:
+        start = time.perf_counter()
+        certificate = certificate_engine.render_certificate(template_image, text_elements, record['texts'])
+        drawn = time.perf_counter()
+        buffer = io.BytesIO()
+        certificate_engine.save_image(certificate, buffer, profile)
+        draw_seconds += drawn - start
+        encode_seconds += time.perf_counter() - drawn
+        encoded_bytes += buffer.tell()
+    results.append(_result("draw", count, draw_seconds, template=name))
+    results.append(_result("encode", count, encode_seconds, encoded_bytes, template=name))
+
+    # Preparing the template (scaling, pre-encoding overlay rows) is a one-off cost
+    # per run, so it is left out of the per-certificate time
+    output_dir = os.path.join(work_dir, f"{name}-certificates")
+    os.makedirs(output_dir, exist_ok=True)
+    prepared = certificate_engine.prepare_template(template_image, profile)
+    start = time.perf_counter()
+    paths = []
+    for record in records:
+        path = os.path.join(output_dir, record['filename'])
+        certificate_engine.write_certificate(prepared, text_elements, record['texts'], path)
+        paths.append(path)
+    written = sum(os.path.getsize(path) for path in paths)
+    results.append(_result("render", count, time.perf_counter() - start, written, template=name))
+
+    qr_dir = os.path.join(work_dir, f"{name}-qr")
+    os.makedirs(qr_dir, exist_ok=True)
+    start = time.perf_counter()
+    qr_written = 0
+    for record in records:
+        path = os.path.join(qr_dir, record['filename'])
+        certificate_id = registry.derive_certificate_id(b"benchmark", name, record)
+        qr_data = qr_stamp.qr_payload(qr_stamp.QR_URL, certificate_id)
+        certificate_engine.write_certificate(prepared, text_elements, record['texts'], path, qr_data)
+        qr_written += os.path.getsize(path)
+    results.append(_result("qr", count, time.perf_counter() - start, qr_written, template=name))
+
+    start = time.perf_counter()
+    with CertificateArchive(os.path.join(work_dir, f"{name}.zip")) as archive:
+        for path in paths:
+            archive.add_file(path)
+    results.append(_result("zip", count, time.perf_counter() - start, archive.size, template=name))
+
+    results.append(bench_email(name, records, paths))
+    return results
+
+
+# Function to time sending certificates through a local SMTP sink
+def bench_email(name, records, paths, workers=4):
+    with LocalSMTPSink(port=0) as sink:
+        settings = SMTPSettings(backend="smtp", host="127.0.0.1", port=sink.port, security="none")
+        jobs = [
+            (record['email'], "Your certificate", "Congratulations!", path)
+            for record, path in zip(records, paths)
+        ]
+        start = time.perf_counter()
+        with SMTPMailer("benchmark@example.com", None, pool_size=workers, settings=settings) as mailer:
+            sent = sum(success for _, success, _ in EmailDispatcher(mailer, workers=workers).dispatch(jobs))
+        seconds = time.perf_counter() - start
+        received = sink.byte_count
+    if sent != len(jobs):
+        _log(f"warning: only {sent} of {len(jobs)} benchmark emails were accepted")
+    return _result("email", sent, seconds, received, template=name)
+
+
+# Function to time a full run: pooled rendering of every row plus the zip
+def bench_generate(name, template, text_elements, data_path, rows, work_dir, profile, workers):
+    output_dir = os.path.join(work_dir, f"{name}-{rows}-generate")
+    zip_path = os.path.join(work_dir, f"{name}-{rows}.zip")
+    records = certificate_engine.iter_file_records(data_path, text_elements, "Email", profile)
+    start = time.perf_counter()
+    with CertificateArchive(zip_path) as archive:
+        for result in certificate_engine.render_batch(template, text_elements, records, output_dir,
+                                                      workers, profile=profile):
+            archive.add_file(result['path'], result['filename'])
+    result = _result("generate", archive.count, time.perf_counter() - start, archive.size, template=name)
+    shutil.rmtree(output_dir)
+    os.remove(zip_path)
+    return result
+
+
+# Function to describe the machine and settings the numbers were taken with
+def environment(args):
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+        'profile': args.profile,
+        'workers': args.workers,
+        'sample': args.sample,
+    }
+
+
+# Function to run the benchmark into a work directory
+def run(args, work_dir):
+    results = []
+    sheets = {}
+    for rows in args.rows:
+        sheets[rows] = write_participants(os.path.join(work_dir, f"participants-{rows}.csv"), rows)
+        _log(f"ingest/layout: {rows} rows")
+        width, height = TEMPLATE_SIZES[args.templates[0]]
+        results.extend(bench_sheet(sheets[rows], rows, synthetic_layout(width, height), args.profile))
+
+    sample_rows = min(args.sample, max(args.rows))
+    sample_path = sheets[max(args.rows)]
+    for name in args.templates:
+        width, height = TEMPLATE_SIZES[name]
+        template = write_template(os.path.join(work_dir, f"template-{name}.png"), width, height)
+        text_elements = synthetic_layout(width, height)
+        records = list(certificate_engine.iter_file_records(sample_path, text_elements, "Email", args.profile))
+        _log(f"certificate stages: {name}, {sample_rows} rows")
+        results.extend(bench_certificates(name, template, text_elements, records[:sample_rows], work_dir,
+                                          args.profile))
+
+        for rows in args.rows:
+            if rows <= args.generate_limit:
+                _log(f"generate: {name}, {rows} rows, {args.workers} workers")
+                results.append(bench_generate(name, template, text_elements, sheets[rows], rows, work_dir,
+                                              args.profile, args.workers))
+    return results
+
+
+# Function to list stages whose throughput dropped compared with a baseline report
+def find_regressions(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    previous = {(entry['stage'], entry['template'], entry['rows']): entry for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        before = previous.get((entry['stage'], entry['template'], entry['rows']))
+        if not before or not before['rows_per_sec'] or not entry['rows_per_sec']:
+            continue
+        if entry['rows_per_sec'] < before['rows_per_sec'] / (1 + tolerance):
+            regressions.append({
+                'stage': entry['stage'],
+                'template': entry['template'],
+                'rows': entry['rows'],
+                'baseline_rows_per_sec': before['rows_per_sec'],
+                'rows_per_sec': entry['rows_per_sec'],
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the certificate pipeline and print JSON results.")
+    parser.add_argument("--rows", type=int, nargs="+", default=list(ROW_COUNTS),
+                        help="Participant sheet sizes (default: 1000 10000 100000)")
+    parser.add_argument("--templates", nargs="+", choices=list(TEMPLATE_SIZES), default=list(TEMPLATE_SIZES),
+                        help="Synthetic template sizes to render")
+    parser.add_argument("--profile", choices=list(certificate_engine.OUTPUT_PROFILES),
+                        default=certificate_engine.DEFAULT_PROFILE)
+    parser.add_argument("--sample", type=int, default=SAMPLE_ROWS,
+                        help="Certificates per template for the draw/encode/render/qr/zip/email stages")
+    parser.add_argument("--generate-limit", type=int, default=GENERATE_LIMIT,
+                        help="Largest row count to run end-to-end generation for")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Render processes for the generate stage (default: one per CPU core)")
+    parser.add_argument("--work-dir", help="Keep generated files here instead of a temporary directory")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--baseline", help="Earlier JSON report; exit with status 1 if a stage got slower")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help="Allowed slowdown against the baseline, as a fraction (default: 0.15)")
+    args = parser.parse_args(argv)
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        results = run(args, args.work_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="certificate-benchmark-") as work_dir:
+            results = run(args, work_dir)
+
+    report = {'environment': environment(args), 'results': results}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            report['regressions'] = find_regressions(results, json.load(baseline_file), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output + "\n")
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,785 @@
+"""Headless certificate rendering engine.
+
+The Streamlit app drives this module from the "Generate & Send" tab, and the
+same code path can be run from a terminal or a cron job:
+
+    python certificate_engine.py --template template.png --data participants.xlsx \
+        --layout layout.json --output certificates/ --zip certificates.zip --workers 16
+
+Rows are sharded across a process pool (one worker per CPU core by default)
+and results come back in input order. The template is decoded once into a
+canonical RGB/RGBA raster which workers attach to through shared memory, so
+per-certificate cost is a cheap pixel copy rather than a decode.
+
+With a cache directory (--cache-dir), every certificate is fingerprinted by a
+hash of the template bytes, the layout and the row's values, and unchanged
+certificates are reused from the cache instead of being rendered again.
+
+--profile picks the output format (print PNG, email JPEG, archive WebP or
+vector PDF, see pdf_output.py), and --merged-pdf also collects every
+certificate into one print-ready PDF. --qr-url stamps a validation QR code on
+every certificate while it is rendered (see qr_stamp.py); certificate IDs are
+derived from --event and the row, and recorded in the local registry that
+`python registry.py verify` checks scanned codes against. Print PNGs are written as template plus
+overlay (see overlay.py): the static rows of the template are compressed once
+and each certificate only renders and encodes the rows its text touches.
+
+Every run reports per-stage timings, rows/sec and latency percentiles (see
+metrics.py); --metrics saves them as JSON or Prometheus text.
+
+The layout file is the JSON list of text elements exported from the app
+("Export Layout" in the Generate & Send tab).
+"""
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from multiprocessing import shared_memory
+
+from PIL import Image, ImageDraw
+
+import ingest
+import metrics
+import overlay
+import pdf_output
+import qr_stamp
+import registry
+from archive import CertificateArchive
+from fonts import get_font
+from mailer import valid_email_mask
+
+
+# Function to open a template from a path, file-like object or image
+def load_template(source):
+    if isinstance(source, Image.Image):
+        return source
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return Image.open(source)
+
+
+# Function to decode a template once into a canonical RGB/RGBA raster
+# Callers treat the result as read-only and render onto copies of it.
+def decode_template(source):
+    image = load_template(source)
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    return image.convert("RGBA" if has_alpha else "RGB")
+
+
+class SharedTemplate:
+    # Decoded template pixels in a shared memory block that pool workers attach to
+    def __init__(self, raster):
+        data = raster.tobytes()
+        self.mode = raster.mode
+        self.size = raster.size
+        self._shm = shared_memory.SharedMemory(create=True, size=len(data))
+        self._shm.buf[:len(data)] = data
+        self.name = self._shm.name
+
+    # Picklable description handed to workers
+    @property
+    def spec(self):
+        return (self.name, self.mode, self.size)
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+    # Function for a worker to map the shared pixels as a read-only image
+    @staticmethod
+    def attach(spec):
+        name, mode, size = spec
+        # Spawned workers share the parent's resource tracker, which unlinks the block on exit
+        shm = shared_memory.SharedMemory(name=name)
+        image = Image.frombuffer(mode, size, shm.buf, "raw", mode, 0, 1)
+        return shm, image
+
+
+# Function to load a layout (list of text elements) from a JSON file
+def load_layout(path):
+    with open(path, "r", encoding="utf-8") as layout_file:
+        return json.load(layout_file)
+
+
+# Function to serialize a layout so it can be reused from the command line
+def dump_layout(text_elements):
+    return json.dumps(text_elements, indent=2)
+
+
+# Function to draw the text of every element onto an image
+def draw_fields(image, text_elements, texts):
+    draw = ImageDraw.Draw(image)
+    for element, text in zip(text_elements, texts):
+        if text is None:
+            continue
+        draw.text(
+            (element['actual_x'], element['actual_y']),
+            text,
+            fill=element['color'],
+            font=get_font(element['font_size'], element.get('font')),
+            anchor="mm"
+        )
+    return image
+
+
+# Function to render a single certificate from the template
+def render_certificate(template, text_elements, texts):
+    certificate = template.copy()
+    return draw_fields(certificate, text_elements, texts)
+
+
+# Longest side of the Design tab preview, matching the canvas width
+PREVIEW_MAX_SIZE = 800
+
+
+# Function to shrink a decoded template to preview size, returning (image, scale)
+# Transparent templates are flattened onto white so the preview can be a JPEG.
+def preview_base(template_image, max_size=PREVIEW_MAX_SIZE):
+    base = flatten_alpha(template_image)
+    scale = min(1.0, max_size / max(base.size))
+    if scale < 1.0:
+        size = (max(1, round(base.width * scale)), max(1, round(base.height * scale)))
+        base = base.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return base, scale
+
+
+# Function to draw the field labels onto a preview base and encode it as JPEG
+def render_preview(base, scale, text_elements, quality=85):
+    preview = base.copy()
+    draw = ImageDraw.Draw(preview)
+    for element in text_elements:
+        draw.text(
+            (element['actual_x'] * scale, element['actual_y'] * scale),
+            element['field'],
+            fill=element['color'],
+            font=get_font(max(1, round(element['font_size'] * scale)), element.get('font')),
+            anchor="mm"
+        )
+    buffer = io.BytesIO()
+    preview.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+# Output profiles: file format, encoder settings and an optional cap on the
+# longest side. The record filename carries the profile's extension, and
+# 'overlay' profiles encode the template once and only the text rows per certificate.
+#   print   - lossless PNG at full resolution, fastest zlib level, overlay encoding
+#   email   - progressive JPEG, scaled down to at most 2000px
+#   archive - lossless WebP, ~40% smaller than PNG but slower to encode
+#   pdf     - vector text over the template image (see pdf_output.py)
+OUTPUT_PROFILES = {
+    "print": {'extension': "png", 'format': "PNG", 'mime': "image/png", 'max_side': None,
+              'options': {'compress_level': 1}, 'overlay': True},
+    "email": {'extension': "jpg", 'format': "JPEG", 'mime': "image/jpeg", 'max_side': 2000,
+              'options': {'quality': 82, 'optimize': True, 'progressive': True}},
+    "archive": {'extension': "webp", 'format': "WEBP", 'mime': "image/webp", 'max_side': None,
+                'options': {'lossless': True, 'method': 4}},
+    "pdf": {'extension': "pdf", 'format': "PDF", 'mime': "application/pdf", 'max_side': None,
+            'options': {}},
+}
+
+DEFAULT_PROFILE = "print"
+
+
+# Function to list the profiles this installation can write (pdf needs reportlab)
+def available_profiles():
+    return [profile for profile in OUTPUT_PROFILES if profile != "pdf" or pdf_output.available()]
+
+
+# Function to number a filename that is already taken (Alice_certificate_2.png)
+def _unique_filename(filename, taken_filenames):
+    if filename in taken_filenames:
+        stem, ext = os.path.splitext(filename)
+        counter = 2
+        while f"{stem}_{counter}{ext}" in taken_filenames:
+            counter += 1
+        filename = f"{stem}_{counter}{ext}"
+    taken_filenames.add(filename)
+    return filename
+
+
+# Function to turn participant rows into render records
+# Each record holds the row index, output filename, one text per element
+# (None when the field is not a column) and the validated email, if any.
+# All strings are computed column-wise up front, so the render loop only
+# sees plain Python values. Participants who share a name get numbered
+# filenames; pass the same taken_filenames set for every chunk of one file.
+def prepare_records(df, text_elements, email_column=None, profile=DEFAULT_PROFILE, taken_filenames=None):
+    if df.empty:
+        return []
+
+    # Skip empty rows
+    keep = df.notna().any(axis=1).to_numpy()
+    indexes = df.index.tolist()
+
+    text_columns = []
+    for element in text_elements:
+        field_name = element['field']
+        if field_name in df.columns:
+            column = df[field_name]
+            text_columns.append(column.astype(str).where(column.notna(), "").tolist())
+        else:
+            text_columns.append([None] * len(df))
+
+    # Use name if available (assume first column is name)
+    extension = OUTPUT_PROFILES[profile]['extension']
+    names = df.iloc[:, 0]
+    participants = names.astype(str).where(names.notna(), None).tolist()
+    named = (names.astype(str).str.replace(" ", "_") + f"_certificate.{extension}").where(names.notna()).tolist()
+    filenames = [
+        name if isinstance(name, str) else f"certificate_{idx+1}.{extension}"
+        for idx, name in zip(indexes, named)
+    ]
+    if taken_filenames is None:
+        taken_filenames = set()
+    filenames = [
+        _unique_filename(filename, taken_filenames) if kept else filename
+        for filename, kept in zip(filenames, keep)
+    ]
+
+    if email_column and email_column in df.columns:
+        emails = df[email_column]
+        emails = [
+            email if isinstance(email, str) else None
+            for email in emails.where(valid_email_mask(emails)).tolist()
+        ]
+    else:
+        emails = [None] * len(df)
+
+    texts_by_row = zip(*text_columns) if text_columns else ([] for _ in indexes)
+    return [
+        {
+            'index': idx,
+            'filename': filename,
+            'texts': list(texts),
+            'email': email,
+            'participant': participant,
+        }
+        for idx, filename, texts, email, participant, kept
+        in zip(indexes, filenames, texts_by_row, emails, participants, keep)
+        if kept
+    ]
+
+
+# Layout keys that affect the rendered pixels
+LAYOUT_KEYS = ('field', 'font_size', 'color', 'actual_x', 'actual_y', 'font')
+
+CACHE_DIR = os.environ.get("CERTIFICATE_CACHE_DIR", "render_cache")
+
+
+# Function to hash everything a batch shares: template bytes and layout
+def batch_fingerprint(template_bytes, text_elements, profile=DEFAULT_PROFILE):
+    layout = [{key: element.get(key) for key in LAYOUT_KEYS} for element in text_elements]
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(template_bytes).digest())
+    digest.update(json.dumps(layout, sort_keys=True).encode("utf-8"))
+    digest.update(json.dumps(OUTPUT_PROFILES[profile], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Function to hash one certificate: the batch fingerprint plus the row's values
+def record_fingerprint(batch_key, texts):
+    digest = hashlib.sha256(batch_key.encode("ascii"))
+    digest.update(json.dumps(texts).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Function to locate a cached render by fingerprint
+def cache_path(cache_dir, fingerprint, ext=".png"):
+    return os.path.join(cache_dir, fingerprint[:2], fingerprint + ext)
+
+
+# Function to locate a record's cached render; a QR payload is part of its fingerprint
+def record_cache_path(cache_dir, batch_key, record, qr_data=None):
+    values = record['texts'] + [qr_data] if qr_data else record['texts']
+    return cache_path(cache_dir, record_fingerprint(batch_key, values), os.path.splitext(record['filename'])[1])
+
+
+# Function to build the QR payload for a record that has a certificate ID
+def record_qr_data(record, qr_url):
+    if qr_url and record.get('certificate_id'):
+        return qr_stamp.qr_payload(qr_url, record['certificate_id'])
+    return None
+
+
+# Function to place a file at dest as a hard link, copying if linking is not possible
+def _link_or_copy(src, dest):
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return
+    tmp_path = _temp_path(dest)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dest)
+
+
+def _temp_path(dest):
+    return f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+# Function to write a file through a temporary path and move it into place
+# An output path may be a hard link to a cache entry; replacing the directory
+# entry instead of rewriting the file leaves the cached inode untouched.
+def _write_replacing(write, dest):
+    tmp_path = _temp_path(dest)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Function to flatten transparency onto white (for JPEG and other RGB-only outputs)
+def flatten_alpha(image):
+    if image.mode == "RGBA":
+        flattened = Image.new("RGB", image.size, "white")
+        flattened.paste(image, mask=image.getchannel("A"))
+        return flattened
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+# Function to save a finished image with an output profile's format and encoder settings
+# Used for generated certificates as well as QR-stamped and personalized ones.
+def save_image(image, destination, profile=DEFAULT_PROFILE):
+    settings = OUTPUT_PROFILES[profile]
+    max_side = settings['max_side']
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    if settings['format'] in ("JPEG", "PDF"):
+        image = flatten_alpha(image)
+    image.save(destination, format=settings['format'], **settings['options'])
+
+
+# Function to scale a layout's positions and font sizes
+def scale_layout(text_elements, scale):
+    return [
+        dict(
+            element,
+            actual_x=element['actual_x'] * scale,
+            actual_y=element['actual_y'] * scale,
+            font_size=max(1, round(element['font_size'] * scale))
+        )
+        for element in text_elements
+    ]
+
+
+class ImageTemplate:
+    # Decoded template prepared for raster output with a profile
+    # Profiles with a size cap scale the template once here, and the layout with it,
+    # so text is drawn at the output resolution instead of resizing every certificate.
+    def __init__(self, template_image, profile=DEFAULT_PROFILE):
+        self.profile = profile
+        max_side = OUTPUT_PROFILES[profile]['max_side']
+        self.scale = min(1.0, max_side / max(template_image.size)) if max_side else 1.0
+        if self.scale < 1.0:
+            size = (max(1, round(template_image.width * self.scale)), max(1, round(template_image.height * self.scale)))
+            template_image = template_image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if OUTPUT_PROFILES[profile]['format'] == "JPEG":
+            template_image = flatten_alpha(template_image)
+        self.image = template_image
+        self.encoder = None
+        if OUTPUT_PROFILES[profile].get('overlay'):
+            self.encoder = overlay.OverlayPNGEncoder(
+                template_image, OUTPUT_PROFILES[profile]['options'].get('compress_level', 6)
+            )
+
+    # Function to build the QR code for a certificate at this template's scale, with its position
+    def qr_stamp(self, qr_data):
+        with metrics.stage("qr_stamp"):
+            code = qr_stamp.qr_image(qr_data, max(1, round(qr_stamp.QR_SIZE * self.scale)))
+        return code, qr_stamp.qr_position(self.image.size, code.width, round(qr_stamp.QR_MARGIN * self.scale))
+
+    def write(self, destination, text_elements, texts, qr_data=None):
+        if self.scale < 1.0:
+            text_elements = scale_layout(text_elements, self.scale)
+        stamps = [self.qr_stamp(qr_data)] if qr_data else []
+        if self.encoder is not None:
+            self.encoder.write(destination, text_elements, texts, stamps)
+            return
+        with metrics.stage("draw"):
+            certificate = render_certificate(self.image, text_elements, texts)
+            for code, position in stamps:
+                certificate.paste(code, position)
+        with metrics.stage("encode"):
+            save_image(certificate, destination, self.profile)
+
+
+# Function to prepare a decoded template for an output profile, once per process
+def prepare_template(template_image, profile=DEFAULT_PROFILE):
+    if profile == "pdf":
+        return pdf_output.PDFTemplate(template_image)
+    return ImageTemplate(template_image, profile)
+
+
+# Function to write one certificate with a template from prepare_template
+# A QR code for qr_data is composited before the certificate is encoded.
+def write_certificate(template, text_elements, texts, destination, qr_data=None):
+    template.write(destination, text_elements, texts, qr_data)
+
+
+# Function to render one certificate with every available profile, returning encode time and size
+# A first, untimed write warms up per-template work (fonts, pre-encoded overlay rows),
+# so the time shown is what each further certificate costs.
+def measure_profiles(template, text_elements, texts, profiles=None):
+    template_image = decode_template(template)
+    measurements = []
+    for profile in profiles or available_profiles():
+        prepared = prepare_template(template_image, profile)
+        write_certificate(prepared, text_elements, texts, io.BytesIO())
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        write_certificate(prepared, text_elements, texts, buffer)
+        measurements.append({
+            'profile': profile,
+            'seconds': time.perf_counter() - start,
+            'bytes': len(buffer.getvalue()),
+        })
+    return measurements
+
+
+# Function to render one record and save it into the output directory
+# With a cache_dir, an identical certificate from an earlier run is reused instead.
+# With a qr_url, a record carrying a certificate_id gets a QR code linking to the
+# URL for it, and the result includes the output file's hash for the registry.
+# The result also carries the record's texts (for a merged PDF), its stage timings
+# and the process's peak RSS.
+def render_record(template_image, text_elements, record, output_dir, cache_dir=None, batch_key=None,
+                  qr_url=None):
+    start = time.perf_counter()
+    cert_path = os.path.join(output_dir, record['filename'])
+    qr_data = record_qr_data(record, qr_url)
+    cached = False
+    if cache_dir and batch_key:
+        cached_file = record_cache_path(cache_dir, batch_key, record, qr_data)
+        cached = os.path.exists(cached_file)
+
+    if cached:
+        try:
+            _link_or_copy(cached_file, cert_path)
+            # Marks the entry as recently used for the job sweep's cache eviction
+            os.utime(cached_file)
+        except FileNotFoundError:
+            # Evicted since the check above
+            cached = False
+    if not cached:
+        _write_replacing(
+            lambda path: write_certificate(template_image, text_elements, record['texts'], path, qr_data),
+            cert_path
+        )
+        if cache_dir and batch_key:
+            os.makedirs(os.path.dirname(cached_file), exist_ok=True)
+            _link_or_copy(cert_path, cached_file)
+
+    return {
+        'index': record['index'],
+        'filename': record['filename'],
+        'path': cert_path,
+        'email': record['email'],
+        'participant': record.get('participant'),
+        'cached': cached,
+        'certificate_id': record.get('certificate_id') if qr_data else None,
+        'texts': record['texts'],
+        'qr_data': qr_data,
+        'image_sha256': registry.file_sha256(cert_path) if qr_data else None,
+        'timings': dict(metrics.drain(), render=time.perf_counter() - start),
+        'peak_rss': metrics.peak_rss(),
+    }
+
+
+# Function to count records that are not in the cache yet
+def count_uncached(records, cache_dir, batch_key, qr_url=None):
+    return sum(
+        not os.path.exists(record_cache_path(cache_dir, batch_key, record, record_qr_data(record, qr_url)))
+        for record in records
+    )
+
+
+# Function to read the encoded template bytes so they can be sent to workers
+def read_template_bytes(template):
+    if isinstance(template, (bytes, bytearray)):
+        return bytes(template)
+    if isinstance(template, Image.Image):
+        buffer = io.BytesIO()
+        template.save(buffer, format="PNG")
+        return buffer.getvalue()
+    if hasattr(template, "read"):
+        template.seek(0)
+        return template.read()
+    with open(template, "rb") as template_file:
+        return template_file.read()
+
+
+# Batches smaller than this render serially; spawning workers would cost more
+PARALLEL_MIN_ROWS = 32
+
+# Records handed to the pool at a time; large lists are streamed window by window
+RENDER_WINDOW = 4096
+
+# Per-process state for pool workers, filled once by _init_worker
+_worker_state = {}
+
+
+def _init_worker(template_spec, text_elements, output_dir, profile, options):
+    shm, template_image = SharedTemplate.attach(template_spec)
+    _worker_state['shm'] = shm
+    _worker_state['template'] = prepare_template(template_image, profile)
+    _worker_state['text_elements'] = text_elements
+    _worker_state['output_dir'] = output_dir
+    _worker_state['options'] = options
+
+
+def _render_in_worker(record):
+    return render_record(
+        _worker_state['template'],
+        _worker_state['text_elements'],
+        record,
+        _worker_state['output_dir'],
+        **_worker_state['options']
+    )
+
+
+# Function to split a record stream into lists of at most size records
+def _windows(records, size):
+    while True:
+        window = list(islice(records, size))
+        if not window:
+            return
+        yield window
+
+
+# Function to pick how many records each worker takes per round trip
+def _chunk_size(total, workers):
+    return max(1, min(64, total // (workers * 4)))
+
+
+# Function to render every record and save it into the output directory
+# Yields one result per record, in input order, as soon as it is written.
+# With workers > 1 the rows are sharded across a process pool; with a
+# cache_dir, only rows whose fingerprint is not cached yet are rendered.
+# With a qr_url, QR codes are stamped in the same pass, inside the workers; each
+# certificate's ID is derived from the event and its row, and every certificate
+# issued is recorded in the registry (see registry.py).
+# With a PipelineMetrics, every result's stage timings are added to it.
+def render_batch(template, text_elements, records, output_dir, workers=1, cache_dir=None,
+                 profile=DEFAULT_PROFILE, qr_url=None, event=None, certificate_registry=None,
+                 pipeline_metrics=None):
+    os.makedirs(output_dir, exist_ok=True)
+    if workers is None or workers < 1:
+        workers = os.cpu_count() or 1
+    if pipeline_metrics is not None:
+        pipeline_metrics.start()
+
+    options = {}
+    template_bytes = read_template_bytes(template) if cache_dir or qr_url else None
+    if cache_dir:
+        batch_key = batch_fingerprint(template_bytes, text_elements, profile)
+        options = {'cache_dir': cache_dir, 'batch_key': batch_key}
+    if qr_url:
+        # IDs are deterministic, so a QR certificate is as cacheable as any other
+        options['qr_url'] = qr_url
+        certificate_registry = certificate_registry or registry.CertificateRegistry()
+        event = event or default_event(template_bytes)
+        records = (
+            dict(record, certificate_id=certificate_registry.certificate_id(event, record))
+            for record in records
+        )
+    results = _render_records(template, text_elements, records, output_dir, workers, profile, options)
+    if qr_url:
+        results = registry.record_results(certificate_registry, event, results)
+
+    for result in results:
+        if pipeline_metrics is not None:
+            pipeline_metrics.add_result(result)
+        yield result
+
+
+# Function to name an event after its template when no name is given
+def default_event(template_bytes):
+    return "template-" + hashlib.sha256(template_bytes).hexdigest()[:16]
+
+
+def _render_records(template, text_elements, records, output_dir, workers, profile, options):
+    # Look at the first window to decide whether a process pool is worth starting
+    records = iter(records)
+    first_window = list(islice(records, RENDER_WINDOW))
+    if workers > 1 and len(first_window) < RENDER_WINDOW:
+        to_render = count_uncached(first_window, **options) if 'cache_dir' in options else len(first_window)
+        if to_render < PARALLEL_MIN_ROWS:
+            workers = 1
+    records = chain(first_window, records)
+
+    template_image = decode_template(template)
+    if workers <= 1:
+        prepared = prepare_template(template_image, profile)
+        for record in records:
+            yield render_record(prepared, text_elements, record, output_dir, **options)
+        return
+
+    # Spawned workers are safe to start from the threaded Streamlit server
+    shared_template = SharedTemplate(template_image)
+    del template_image
+    try:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(shared_template.spec, text_elements, output_dir, profile, options)
+        ) as executor:
+            # Keep at most two windows of records in flight so memory stays bounded
+            in_flight = None
+            for window in _windows(records, RENDER_WINDOW):
+                submitted = executor.map(
+                    _render_in_worker,
+                    window,
+                    chunksize=_chunk_size(len(window), workers)
+                )
+                if in_flight is not None:
+                    yield from in_flight
+                in_flight = submitted
+            if in_flight is not None:
+                yield from in_flight
+    finally:
+        shared_template.close()
+
+
+# Function to stream render records from a participant file on disk
+# Only the columns the layout uses are read, one chunk at a time.
+def iter_file_records(data_path, text_elements, email_column=None, profile=DEFAULT_PROFILE):
+    header = ingest.read_header(data_path, data_path)
+    columns = ingest.required_columns(header, text_elements, email_column)
+    taken_filenames = set()
+    for chunk in ingest.iter_chunks(data_path, data_path, columns):
+        yield from prepare_records(chunk, text_elements, email_column, profile, taken_filenames)
+
+
+# Function to run a full generation from files on disk
+def generate_certificates(template_path, data_path, layout_path, output_dir,
+                          zip_path=None, email_column=None, workers=1, cache_dir=None, progress=None,
+                          profile=DEFAULT_PROFILE, merged_pdf=None, qr_url=None, event=None,
+                          pipeline_metrics=None):
+    pipeline_metrics = pipeline_metrics or metrics.PipelineMetrics()
+    text_elements = load_layout(layout_path)
+    records = pipeline_metrics.timed(iter_file_records(data_path, text_elements, email_column, profile), "ingest")
+
+    results = []
+    archive = CertificateArchive(zip_path) if zip_path else None
+    try:
+        for result in render_batch(template_path, text_elements, records, output_dir, workers, cache_dir,
+                                   profile, qr_url, event, pipeline_metrics=pipeline_metrics):
+            if archive:
+                with metrics.stage("zip_write", pipeline_metrics):
+                    archive.add_file(result['path'], result['filename'])
+            results.append(result)
+            if progress:
+                progress(len(results))
+    finally:
+        if archive:
+            archive.close()
+
+    # One page per certificate, from the texts each render result carries with its QR payload
+    if merged_pdf:
+        pdf_output.write_merged(
+            decode_template(template_path),
+            text_elements,
+            ((result['texts'], result['qr_data']) for result in results),
+            merged_pdf
+        )
+    pipeline_metrics.finish()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render certificates without the Streamlit UI.")
+    parser.add_argument("--template", required=True, help="Certificate template image")
+    parser.add_argument("--data", required=True, help="Participant data (.xlsx, .xls, .csv or .parquet)")
+    parser.add_argument("--layout", required=True, help="Layout JSON exported from the app")
+    parser.add_argument("--output", help="Directory for rendered certificates")
+    parser.add_argument("--zip", dest="zip_path", help="Also write all certificates into this zip file")
+    parser.add_argument("--email-column", help="Column holding participant email addresses")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Render processes to use (default: one per CPU core)")
+    parser.add_argument("--cache-dir", help="Reuse unchanged certificates from this cache directory")
+    parser.add_argument("--profile", choices=list(OUTPUT_PROFILES), default=DEFAULT_PROFILE,
+                        help="Output profile: print (lossless PNG), email (downscaled JPEG), "
+                             "archive (lossless WebP) or pdf (vector PDF, needs reportlab)")
+    parser.add_argument("--measure-profiles", action="store_true",
+                        help="Render the first participant with every profile, print encode time and size, and exit")
+    parser.add_argument("--merged-pdf", help="Also write every certificate as a page of this PDF, for printing")
+    parser.add_argument("--qr-url", nargs="?", const=qr_stamp.QR_URL,
+                        help="Stamp a validation QR code on every certificate, linking to this URL "
+                             "({cert_id} is replaced by the certificate ID)")
+    parser.add_argument("--metrics", help="Write per-stage timings to this file: JSON, or Prometheus "
+                                          "text if it ends in .prom")
+    parser.add_argument("--event", help="Event name the certificate IDs are derived from "
+                                        "(default: derived from the template)")
+    args = parser.parse_args(argv)
+
+    if args.measure_profiles:
+        text_elements = load_layout(args.layout)
+        record = next(iter_file_records(args.data, text_elements), None)
+        if record is None:
+            parser.error("the participant file has no rows to measure with")
+        print(f"{'profile':<10}{'encode ms':>10}{'size KB':>10}")
+        for measurement in measure_profiles(args.template, text_elements, record['texts']):
+            print(f"{measurement['profile']:<10}{measurement['seconds'] * 1000:>10.1f}{measurement['bytes'] / 1024:>10.1f}")
+        return 0
+    if not args.output:
+        parser.error("--output is required")
+    if args.qr_url and "{cert_id}" not in args.qr_url:
+        parser.error("--qr-url must contain {cert_id}")
+
+    start = time.perf_counter()
+    pipeline_metrics = metrics.PipelineMetrics()
+    results = generate_certificates(
+        args.template,
+        args.data,
+        args.layout,
+        args.output,
+        zip_path=args.zip_path,
+        email_column=args.email_column,
+        workers=args.workers,
+        cache_dir=args.cache_dir,
+        profile=args.profile,
+        merged_pdf=args.merged_pdf,
+        qr_url=args.qr_url,
+        event=args.event,
+        pipeline_metrics=pipeline_metrics,
+    )
+    elapsed = time.perf_counter() - start
+
+    rate = len(results) / elapsed if elapsed else 0.0
+    reused = sum(result['cached'] for result in results)
+    print(f"Generated {len(results)} certificates in {elapsed:.2f}s ({rate:.1f} rows/sec, {reused} reused from cache)")
+
+    summary = pipeline_metrics.summary()
+    print(f"{'stage':<14}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage_name, stats in summary['stages'].items():
+        print(f"{stage_name:<14}{stats['total_seconds']:>10.2f}{stats['p50_ms']:>10.2f}"
+              f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    if summary['peak_rss_bytes']:
+        workers_rss = summary['worker_peak_rss_bytes'] or 0
+        print(f"Peak RSS {summary['peak_rss_bytes'] / 1048576:.0f} MB (largest render worker {workers_rss / 1048576:.0f} MB)")
+    if args.metrics:
+        with open(args.metrics, "w", encoding="utf-8") as metrics_file:
+            if args.metrics.endswith(".prom"):
+                metrics_file.write(metrics.to_prometheus(summary))
+            else:
+                metrics_file.write(metrics.to_json(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
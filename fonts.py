@@ -0,0 +1,47 @@
+"""Shared font registry.
+
+Every (font file, size) pair is resolved and parsed once per process and then
+reused by certificate generation, previews, test emails and personalization.
+The bundled Roboto font is preferred so output looks the same on every server
+instead of silently falling back to Pillow's tiny bitmap font.
+"""
+import os
+from functools import lru_cache
+
+from PIL import ImageFont
+
+import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUNDLED_FONT = os.path.join(BASE_DIR, "Roboto-VariableFont_wdth,wght.ttf")
+
+# Faces tried in order when no explicit font file is requested
+DEFAULT_FACES = (
+    BUNDLED_FONT,
+    "arial.ttf",
+    "Arial.ttf",
+    "DejaVuSans.ttf",
+)
+
+
+# Function to find the first font file that FreeType can open
+@lru_cache(maxsize=None)
+def resolve_face(face=None):
+    candidates = (face,) + DEFAULT_FACES if face else DEFAULT_FACES
+    for candidate in candidates:
+        try:
+            ImageFont.truetype(candidate, 10)
+            return candidate
+        except OSError:
+            continue
+    return None
+
+
+# Function to get a parsed font for a given size, loaded once per process
+@lru_cache(maxsize=256)
+def get_font(size, face=None):
+    with metrics.stage("font_load"):
+        path = resolve_face(face)
+        if path is None:
+            return ImageFont.load_default(size)
+        return ImageFont.truetype(path, size)
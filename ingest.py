@@ -0,0 +1,204 @@
+"""Streaming participant-list ingestion.
+
+Participant sheets are read in chunks of rows instead of loading the whole
+file, and only the columns the layout actually uses are kept. Every value is
+read as text (empty cells stay missing), so there is no second full copy of
+the data for type cleaning. Supported formats are .xlsx (openpyxl read-only
+mode), .xls, .csv and .parquet (needs pyarrow).
+"""
+import csv
+import io
+import os
+
+import pandas as pd
+
+SUPPORTED_EXTENSIONS = (".xlsx", ".xls", ".csv", ".parquet")
+UPLOAD_TYPES = [ext.lstrip(".") for ext in SUPPORTED_EXTENSIONS]
+
+CHUNK_SIZE = 5000
+
+
+# Function to work out the file format from its name
+def detect_format(name):
+    ext = os.path.splitext(name)[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise ValueError(f"Unsupported participant file type: {ext or name}")
+    return ext
+
+
+# Function to rewind uploads and wrap raw bytes so every reader gets a file object
+def _open(source):
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def _cell_text(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _iter_xlsx_chunks(source, columns, chunk_size):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(_open(source), read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [_cell_text(value) or f"Unnamed: {i}" for i, value in enumerate(next(rows, ()))]
+        wanted = columns or header
+        positions = [header.index(column) for column in wanted]
+
+        offset = 0
+        chunk = []
+        for row in rows:
+            chunk.append([_cell_text(row[i]) if i < len(row) else None for i in positions])
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=wanted, index=range(offset, offset + len(chunk)), dtype=object)
+                offset += len(chunk)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=wanted, index=range(offset, offset + len(chunk)), dtype=object)
+    finally:
+        workbook.close()
+
+
+def _iter_csv_chunks(source, columns, chunk_size):
+    if isinstance(source, (str, os.PathLike)):
+        text = None
+        reader = pd.read_csv(source, usecols=columns, dtype=str, chunksize=chunk_size)
+    else:
+        # Decode uploads through our own wrapper and detach it afterwards; otherwise
+        # pandas' wrapper closes the upload when reading stops early (e.g. a preview)
+        text = io.TextIOWrapper(_open(source), encoding="utf-8-sig", newline="")
+        reader = pd.read_csv(text, usecols=columns, dtype=str, chunksize=chunk_size)
+    try:
+        for chunk in reader:
+            yield chunk[columns] if columns else chunk
+    finally:
+        reader.close()
+        if text is not None:
+            text.detach()
+
+
+def _iter_parquet_chunks(source, columns, chunk_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Reading Parquet files requires the 'pyarrow' package")
+
+    parquet_file = pq.ParquetFile(_open(source))
+    offset = 0
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+        chunk = batch.to_pandas().astype("string").astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        chunk.index = range(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+
+def _iter_xls_chunks(source, columns, chunk_size):
+    # Legacy .xls has no streaming reader; load it once and hand it out in chunks
+    df = pd.read_excel(_open(source), usecols=columns, dtype=str)
+    if columns:
+        df = df[columns]
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+
+# Function to stream a participant file as DataFrame chunks of text values
+# Only the requested columns are read (all columns when columns is None).
+def iter_chunks(source, name, columns=None, chunk_size=CHUNK_SIZE):
+    ext = detect_format(name)
+    columns = list(dict.fromkeys(columns)) if columns else None
+    if ext == ".xlsx":
+        return _iter_xlsx_chunks(source, columns, chunk_size)
+    if ext == ".csv":
+        return _iter_csv_chunks(source, columns, chunk_size)
+    if ext == ".parquet":
+        return _iter_parquet_chunks(source, columns, chunk_size)
+    return _iter_xls_chunks(source, columns, chunk_size)
+
+
+# Function to read just the column names
+def read_header(source, name):
+    ext = detect_format(name)
+    if ext == ".xlsx":
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(_open(source), read_only=True, data_only=True)
+        try:
+            first_row = next(workbook.active.iter_rows(values_only=True), ())
+        finally:
+            workbook.close()
+        return [_cell_text(value) or f"Unnamed: {i}" for i, value in enumerate(first_row)]
+    if ext == ".csv":
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, encoding="utf-8-sig", newline="") as text:
+                return next(csv.reader(text), [])
+        text = io.TextIOWrapper(_open(source), encoding="utf-8-sig", newline="")
+        try:
+            return next(csv.reader(text), [])
+        finally:
+            text.detach()
+    if ext == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Reading Parquet files requires the 'pyarrow' package")
+        return pq.ParquetFile(_open(source)).schema_arrow.names
+    return pd.read_excel(_open(source), nrows=0).columns.tolist()
+
+
+# Function to read the first rows for a preview table
+def read_preview(source, name, rows=5):
+    chunks = iter_chunks(source, name, chunk_size=rows)
+    try:
+        return next(chunks, None)
+    finally:
+        chunks.close()
+
+
+# Function to count the data rows (header excluded)
+# .xlsx sheets and .parquet files record their size, so only files without that
+# metadata (.csv, legacy .xls, or a sheet written without a dimension) are streamed.
+def count_rows(source, name):
+    ext = detect_format(name)
+    if ext == ".xlsx":
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(_open(source), read_only=True, data_only=True)
+        try:
+            max_row = workbook.active.max_row
+        finally:
+            workbook.close()
+        if max_row is not None:
+            return max(0, max_row - 1)
+    elif ext == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Reading Parquet files requires the 'pyarrow' package")
+        return pq.ParquetFile(_open(source)).metadata.num_rows
+    header = read_header(source, name)
+    return sum(len(chunk) for chunk in iter_chunks(source, name, header[:1]))
+
+
+# Function to list the columns a render needs: the first column names the files
+def required_columns(header, text_elements, email_column=None):
+    columns = header[:1] + [element['field'] for element in text_elements if element['field'] in header]
+    if email_column and email_column in header:
+        columns.append(email_column)
+    return list(dict.fromkeys(columns))
+
+
+# Function to read a whole file (or selected columns) into one DataFrame
+def read_participants(source, name, columns=None):
+    chunks = list(iter_chunks(source, name, columns))
+    if not chunks:
+        return pd.DataFrame(columns=columns or read_header(source, name))
+    return pd.concat(chunks)
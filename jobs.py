@@ -0,0 +1,741 @@
+"""Persistent job queue for certificate generation and email sending.
+
+Jobs and their per-row state live in a local SQLite database, and a background
+JobRunner works through them. A Streamlit rerun, browser refresh or server
+restart therefore never loses progress: the runner picks interrupted jobs up
+again and only processes rows that are still pending, while the UI just polls
+the store for status.
+
+Every generation job writes into its own directory under jobs/. The runner
+sweeps finished jobs away once they are older than a TTL, and oldest first
+while their files and the render cache take more than a disk quota; jobs
+still running, and the certificates an unfinished email job is sending, are
+never evicted.
+
+Jobs can also be run without the app:
+
+    python jobs.py worker          # process queued jobs until interrupted
+    python jobs.py status <job_id>
+    python jobs.py sweep           # evict expired jobs now
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict
+
+import certificate_engine
+import metrics
+import pdf_output
+from archive import CertificateArchive
+from mailer import EmailDispatcher, SMTPMailer, SMTPSettings
+
+JOBS_DIR = os.environ.get("CERTIFICATE_JOBS_DIR", "jobs")
+DB_PATH = os.environ.get("CERTIFICATE_JOBS_DB", os.path.join(JOBS_DIR, "jobs.db"))
+
+# Rendered rows are written back to the store in batches of this size; a crash
+# only means re-rendering them. Sent emails are recorded one by one, since a
+# row left pending would be sent again.
+FLUSH_EVERY = 64
+
+# Rows read from the database per query when streaming a job
+PAGE_SIZE = 1000
+
+FINISHED_STATUSES = ("done", "failed")
+
+# Finished jobs and their files are removed this long after they last changed
+JOB_TTL = float(os.environ.get("CERTIFICATE_JOB_TTL_HOURS", "24")) * 3600
+
+# Finished jobs are removed, oldest first, while their files take more than this
+DISK_QUOTA = int(float(os.environ.get("CERTIFICATE_JOBS_QUOTA_MB", "2048")) * 1024 * 1024)
+
+# Seconds between the runner's eviction sweeps
+SWEEP_INTERVAL = 600
+
+# A running job belongs to the runner that claimed it until its lease runs out; the
+# runner renews the lease while it works, so only a crashed runner's jobs are taken over
+LEASE_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    owner TEXT,
+    lease_until REAL
+);
+CREATE TABLE IF NOT EXISTS job_rows (
+    job_id TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, row_index)
+);
+CREATE INDEX IF NOT EXISTS job_rows_state ON job_rows (job_id, state);
+CREATE TABLE IF NOT EXISTS daily_sends (
+    sender TEXT NOT NULL,
+    day TEXT NOT NULL,
+    sent INTEGER NOT NULL,
+    PRIMARY KEY (sender, day)
+);
+"""
+
+# Columns added to the jobs table after it was first created, for older databases
+JOB_COLUMNS = (("owner", "TEXT"), ("lease_until", "REAL"))
+
+# Jobs a runner may claim: queued ones, and running ones whose runner stopped renewing its lease
+CLAIMABLE = "(status = 'pending' OR (status = 'running' AND (lease_until IS NULL OR lease_until < ?)))"
+
+
+# Function to serialize numpy/pandas scalars that json cannot handle
+def _to_json(value):
+    return json.dumps(value, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+
+
+class JobStore:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            existing = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in JOB_COLUMNS:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+
+    # Function to open a connection for one transaction; one per call keeps the store thread-safe
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _job_from_row(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    # Function to queue a job with one payload per row
+    def create_job(self, kind, params, payloads, job_id=None):
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, params, created_at, updated_at) VALUES (?, ?, 'pending', ?, ?, ?)",
+                (job_id, kind, _to_json(params), now, now)
+            )
+            conn.executemany(
+                "INSERT INTO job_rows (job_id, row_index, state, payload) VALUES (?, ?, 'pending', ?)",
+                ((job_id, i, _to_json(payload)) for i, payload in enumerate(payloads))
+            )
+        return job_id
+
+    def get_job(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job_from_row(row)
+
+    def list_jobs(self, kind=None, limit=20):
+        query = "SELECT * FROM jobs"
+        args = ()
+        if kind:
+            query += " WHERE kind = ?"
+            args = (kind,)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        with self._connect() as conn:
+            rows = conn.execute(query, args + (limit,)).fetchall()
+        return [self._job_from_row(row) for row in rows]
+
+    def set_status(self, job_id, status, error=None, result=None):
+        with self._connect() as conn:
+            if result is None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                    (status, error, time.time(), job_id)
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, result = ?, updated_at = ? WHERE id = ?",
+                    (status, error, _to_json(result), time.time(), job_id)
+                )
+
+    # Function to list every job, least recently updated first
+    def jobs_by_age(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY updated_at").fetchall()
+        return [self._job_from_row(row) for row in rows]
+
+    # Function to claim the oldest job of a kind that still has work to do
+    # The claim is a single UPDATE, so two runners on one store never get the same job.
+    def claim_job(self, kind, owner, lease=LEASE_SECONDS):
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, updated_at = ? "
+                f"WHERE id = (SELECT id FROM jobs WHERE kind = ? AND {CLAIMABLE} ORDER BY created_at LIMIT 1) "
+                f"AND {CLAIMABLE} RETURNING *",
+                (owner, now + lease, now, kind, now, now)
+            ).fetchall()
+        return self._job_from_row(rows[0]) if rows else None
+
+    # Function to extend a claimed job's lease; returns False if another runner has taken it over
+    def renew_lease(self, job_id, owner, lease=LEASE_SECONDS):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time() + lease, job_id, owner)
+            )
+        return cursor.rowcount > 0
+
+    # Function to count one send against a sender's limit for the current UTC day
+    # Returns False, without counting, once the day's limit is used up.
+    def take_daily_send(self, sender, limit):
+        day = time.strftime("%Y-%m-%d", time.gmtime())
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO daily_sends (sender, day, sent) VALUES (?, ?, 1) "
+                "ON CONFLICT (sender, day) DO UPDATE SET sent = sent + 1 WHERE sent < ?",
+                (sender, day, limit)
+            )
+        return cursor.rowcount > 0
+
+    # Function to page through a job's rows in row_index order
+    # Each page is a separate query, so rows can be updated while iterating.
+    def _iter_rows(self, job_id, condition, columns):
+        last_index = -1
+        while True:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    f"SELECT {columns} FROM job_rows WHERE job_id = ? AND {condition} AND row_index > ? "
+                    "ORDER BY row_index LIMIT ?",
+                    (job_id, last_index, PAGE_SIZE)
+                ).fetchall()
+            yield from rows
+            if len(rows) < PAGE_SIZE:
+                return
+            last_index = rows[-1]['row_index']
+
+    # Function to stream (row_index, payload) for rows that still need processing
+    def pending_rows(self, job_id):
+        for row in self._iter_rows(job_id, "state = 'pending'", "row_index, payload"):
+            yield row['row_index'], json.loads(row['payload'])
+
+    # Function to record (row_index, state, result, error) updates in one transaction
+    def update_rows(self, job_id, updates):
+        if not updates:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE job_rows SET state = ?, result = ?, error = ? WHERE job_id = ? AND row_index = ?",
+                (
+                    (state, _to_json(result) if result is not None else None, error, job_id, row_index)
+                    for row_index, state, result, error in updates
+                )
+            )
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    # Function to count rows per state, e.g. {'pending': 10, 'done': 90}
+    def row_counts(self, job_id):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT state, COUNT(*) AS n FROM job_rows WHERE job_id = ? GROUP BY state",
+                (job_id,)
+            ).fetchall()
+        return {row['state']: row['n'] for row in rows}
+
+    # Function to stream processed rows with their payload, result and error
+    def finished_rows(self, job_id):
+        for row in self._iter_rows(job_id, "state != 'pending'", "row_index, state, payload, result, error"):
+            yield {
+                'row_index': row['row_index'],
+                'state': row['state'],
+                'payload': json.loads(row['payload']),
+                'result': json.loads(row['result']) if row['result'] else None,
+                'error': row['error'],
+            }
+
+
+# Function to create a working directory for a job
+def job_directory(job_id, root=JOBS_DIR):
+    path = os.path.join(root, job_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# Function to queue a certificate generation job
+# The template is copied into the job directory so the job can resume after a restart.
+def submit_generation(store, template, text_elements, records, workers=1, cache_dir=None, root=JOBS_DIR,
+                      profile=certificate_engine.DEFAULT_PROFILE, merged_pdf=False, qr_url=None, event=None,
+                      job_id=None):
+    job_id = job_id or uuid.uuid4().hex
+    job_dir = job_directory(job_id, root)
+    template_path = os.path.join(job_dir, "template")
+    with open(template_path, "wb") as template_file:
+        template_file.write(certificate_engine.read_template_bytes(template))
+
+    params = {
+        'template_path': template_path,
+        'text_elements': text_elements,
+        'output_dir': os.path.join(job_dir, "certificates"),
+        'zip_path': os.path.join(job_dir, "certificates.zip"),
+        'workers': workers,
+        'cache_dir': cache_dir,
+        'profile': profile,
+        'merged_pdf_path': os.path.join(job_dir, "certificates.pdf") if merged_pdf else None,
+        'qr_url': qr_url,
+        'event': event,
+    }
+    return store.create_job("generate", params, records, job_id=job_id)
+
+
+# Function to queue an email job; each item is (recipient, attachment_path)
+# The password is not persisted; hand it to JobRunner.set_secret.
+# source_job is the generation job whose certificates are attached; it is kept until sending ends.
+def submit_email(store, sender_email, settings, subject, body, recipients,
+                 workers=4, per_second=None, per_minute=None, per_day=None, job_id=None, source_job=None):
+    params = {
+        'sender_email': sender_email,
+        'settings': asdict(settings),
+        'subject': subject,
+        'body': body,
+        'workers': workers,
+        'per_second': per_second,
+        'per_minute': per_minute,
+        'per_day': per_day,
+        'source_job': source_job,
+    }
+    payloads = [{'email': email, 'attachment_path': path} for email, path in recipients]
+    return store.create_job("email", params, payloads, job_id=job_id)
+
+
+class DailySendQuota:
+    # A sender's messages-per-day limit, counted in the job store so it holds across jobs and restarts
+    def __init__(self, store, sender, limit):
+        self.store = store
+        self.sender = sender
+        self.limit = limit
+
+    # Function to take one send from today's allowance; waiting would not help, so timeout is unused
+    def acquire(self, timeout=None):
+        return self.store.take_daily_send(self.sender, self.limit)
+
+
+class JobRunner:
+    def __init__(self, store, kinds=("generate", "email"), poll_interval=1.0, root=JOBS_DIR,
+                 ttl=JOB_TTL, quota=DISK_QUOTA, sweep_interval=SWEEP_INTERVAL, lease=LEASE_SECONDS,
+                 cache_dir=certificate_engine.CACHE_DIR):
+        self.store = store
+        # Identifies this runner's claims in the store
+        self.owner = uuid.uuid4().hex
+        self.lease = lease
+        self.kinds = kinds
+        self.poll_interval = poll_interval
+        self.root = root
+        self.ttl = ttl
+        self.quota = quota
+        self.cache_dir = cache_dir
+        self.sweep_interval = sweep_interval
+        # PipelineMetrics per job run in this process, readable while the job runs
+        self.live_metrics = {}
+        self._metrics_lock = threading.Lock()
+        self._secrets = {}
+        self._stop = threading.Event()
+        self._threads = []
+
+    # Function to provide an email job's password (kept in memory only)
+    def set_secret(self, job_id, password):
+        self._secrets[job_id] = password
+
+    # Function to queue an email job with its password registered up front
+    def submit_email(self, password, sender_email, settings, subject, body, recipients, **limits):
+        job_id = uuid.uuid4().hex
+        self.set_secret(job_id, password)
+        return submit_email(self.store, sender_email, settings, subject, body, recipients,
+                            job_id=job_id, **limits)
+
+    # Function to resume a paused email job once its password is known again
+    def resume(self, job_id, password):
+        self.set_secret(job_id, password)
+        self.store.set_status(job_id, "pending")
+
+    # Function to get (or start) the metrics collected for a job
+    def metrics_for(self, job_id, latency_stage="render"):
+        with self._metrics_lock:
+            if job_id not in self.live_metrics:
+                self.live_metrics[job_id] = metrics.PipelineMetrics(latency_stage)
+            return self.live_metrics[job_id]
+
+    # Function to start one background thread per job kind
+    def start(self):
+        if self._threads:
+            return self
+        for kind in self.kinds:
+            thread = threading.Thread(target=self._loop, args=(kind,), daemon=True, name=f"job-runner-{kind}")
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._sweep_loop, daemon=True, name="job-runner-sweep")
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _loop(self, kind):
+        while not self._stop.is_set():
+            job = self.store.claim_job(kind, self.owner, self.lease)
+            if job is None or not self.run_job(job):
+                self._stop.wait(self.poll_interval)
+
+    def _sweep_loop(self):
+        while not self._stop.is_set():
+            self.sweep()
+            self._stop.wait(self.sweep_interval)
+
+    # Function to evict expired jobs and enforce the disk quota; returns the evicted job ids
+    def sweep(self):
+        try:
+            evicted = evict_jobs(self.store, self.root, self.ttl, self.quota, cache_dir=self.cache_dir)
+        except (OSError, sqlite3.Error):
+            # A busy database or a file in use; the next sweep tries again
+            return []
+        with self._metrics_lock:
+            for job_id in evicted:
+                self.live_metrics.pop(job_id, None)
+        return evicted
+
+    # Function to keep renewing a claimed job's lease while the block runs
+    @contextmanager
+    def _holding_lease(self, job_id):
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.lease / 3):
+                try:
+                    self.store.renew_lease(job_id, self.owner, self.lease)
+                except sqlite3.Error:
+                    pass
+
+        thread = threading.Thread(target=renew, daemon=True, name=f"job-lease-{job_id}")
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    # Function to run (or resume) one claimed job; returns False if it cannot run yet
+    def run_job(self, job):
+        try:
+            with self._holding_lease(job['id']):
+                if job['kind'] == "generate":
+                    self.store.set_status(job['id'], "running")
+                    self._run_generation(job)
+                elif job['kind'] == "email":
+                    if not self._can_send(job):
+                        return False
+                    self.store.set_status(job['id'], "running")
+                    self._run_email(job)
+                else:
+                    self.store.set_status(job['id'], "failed", error=f"Unknown job kind: {job['kind']}")
+        except Exception as e:
+            self.store.set_status(job['id'], "failed", error=str(e))
+        if job['kind'] == "generate":
+            # A finished job may have pushed the jobs directory over its quota
+            self.sweep()
+        return True
+
+    def _can_send(self, job):
+        settings = SMTPSettings(**job['params']['settings'])
+        if settings.requires_login and job['id'] not in self._secrets:
+            # Lost the password in a restart; wait for the UI to supply it again
+            self.store.set_status(job['id'], "paused", error="Re-enter the email password to resume sending.")
+            return False
+        return True
+
+    def _run_generation(self, job):
+        params = job['params']
+        # Results come back in input order, so a queue of row indexes is enough
+        # to match them up without holding every payload in memory
+        row_indexes = deque()
+
+        def records():
+            for row_index, payload in self.store.pending_rows(job['id']):
+                row_indexes.append(row_index)
+                yield payload
+
+        job_metrics = self.metrics_for(job['id'])
+        updates = []
+        for result in certificate_engine.render_batch(
+            params['template_path'],
+            params['text_elements'],
+            records(),
+            params['output_dir'],
+            workers=params.get('workers', 1),
+            cache_dir=params.get('cache_dir'),
+            profile=params.get('profile', certificate_engine.DEFAULT_PROFILE),
+            qr_url=params.get('qr_url'),
+            event=params.get('event'),
+            pipeline_metrics=job_metrics
+        ):
+            updates.append((row_indexes.popleft(), "done", result, None))
+            if len(updates) >= FLUSH_EVERY:
+                self.store.update_rows(job['id'], updates)
+                updates = []
+        self.store.update_rows(job['id'], updates)
+
+        # Package every finished certificate, including those from earlier runs
+        with CertificateArchive(params['zip_path']) as archive:
+            for row in self.store.finished_rows(job['id']):
+                if row['state'] == "done":
+                    with metrics.stage("zip_write", job_metrics):
+                        archive.add_file(row['result']['path'], row['result']['filename'])
+            count = archive.count
+        result = {'zip_path': params['zip_path'], 'count': count, 'output_dir': params['output_dir']}
+
+        # One print-ready PDF with a page per certificate, built from the stored row texts
+        if params.get('merged_pdf_path'):
+            pdf_output.write_merged(
+                certificate_engine.decode_template(params['template_path']),
+                params['text_elements'],
+                (
+                    (row['payload']['texts'], row['result'].get('qr_data'))
+                    for row in self.store.finished_rows(job['id'])
+                    if row['state'] == "done"
+                ),
+                params['merged_pdf_path']
+            )
+            result['merged_pdf_path'] = params['merged_pdf_path']
+        # Measured once here, so eviction never has to walk a finished job's files
+        result['disk_bytes'] = directory_size(os.path.dirname(params['template_path']))
+        job_metrics.finish()
+        result['metrics'] = job_metrics.summary()
+        self.store.set_status(job['id'], "done", result=result)
+
+    def _run_email(self, job):
+        params = job['params']
+        settings = SMTPSettings(**params['settings'])
+        # The row index rides along with each message, so recipients listed twice stay separate rows
+        messages = [
+            (payload['email'], params['subject'], params['body'], payload['attachment_path'], row_index)
+            for row_index, payload in self.store.pending_rows(job['id'])
+        ]
+
+        job_metrics = self.metrics_for(job['id'], latency_stage="smtp_send")
+        job_metrics.start()
+        with SMTPMailer(params['sender_email'],
+                        self._secrets.get(job['id']),
+                        pool_size=params['workers'],
+                        settings=settings,
+                        pipeline_metrics=job_metrics) as mailer:
+            dispatcher = EmailDispatcher(
+                mailer,
+                workers=params['workers'],
+                per_second=params['per_second'],
+                per_minute=params['per_minute'],
+                daily_quota=DailySendQuota(self.store, params['sender_email'], params['per_day'])
+                if params['per_day'] else None
+            )
+            for sent, success, message in dispatcher.dispatch(messages):
+                job_metrics.count()
+                row_index = sent[-1]
+                if success:
+                    self.store.update_rows(job['id'], [(row_index, "done", {'message': message}, None)])
+                else:
+                    self.store.update_rows(job['id'], [(row_index, "failed", None, message)])
+
+        job_metrics.finish()
+        counts = self.store.row_counts(job['id'])
+        self.store.set_status(job['id'], "done", result={'counts': counts, 'metrics': job_metrics.summary()})
+
+
+# Function to delete a job's rows and its working directory
+def delete_job(store, job_id, root=JOBS_DIR):
+    with store._connect() as conn:
+        conn.execute("DELETE FROM job_rows WHERE job_id = ?", (job_id,))
+        conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+    shutil.rmtree(os.path.join(root, job_id), ignore_errors=True)
+
+
+# Function to add up the size of the files under a directory that nothing else links to
+# A certificate hard-linked from the render cache is counted with the cache instead,
+# since deleting the directory would not free it.
+def directory_size(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            if stat.st_nlink == 1:
+                total += stat.st_size
+    return total
+
+
+# Function to find how much disk a job uses (measured when it finished, if it has files)
+def job_disk_bytes(job, root=JOBS_DIR):
+    result = job['result'] or {}
+    if 'disk_bytes' in result:
+        return result['disk_bytes']
+    return directory_size(os.path.join(root, job['id']))
+
+
+# Function to list render cache entries as (mtime, path, size, links), least recently used first
+def cache_entries(cache_dir):
+    entries = []
+    for directory, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size, stat.st_nlink))
+    entries.sort()
+    return entries
+
+
+# Function to delete a cache entry if no job output links to it any more; returns whether it did
+def _evict_cache_entry(path):
+    try:
+        if os.stat(path).st_nlink > 1:
+            return False
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+# Function to delete finished jobs older than ttl, then the oldest ones while they use more than quota
+# Unfinished jobs, and the generation jobs unfinished email jobs attach from, are kept; a
+# job paused for longer than the ttl (e.g. an email job nobody resumed) expires too. The
+# newest finished generation job is only removed by the ttl, never to make room, so a job
+# bigger than the quota survives until the user has downloaded it.
+# Render cache entries count towards the quota too. Unused ones expire with the ttl and go
+# first when making room, as they can be re-rendered; an entry a job output still links
+# to is kept until that job is gone.
+def evict_jobs(store, root=JOBS_DIR, ttl=JOB_TTL, quota=DISK_QUOTA, now=None,
+               cache_dir=certificate_engine.CACHE_DIR):
+    now = now or time.time()
+    jobs = store.jobs_by_age()
+    pinned = set()
+    for job in jobs:
+        if job['status'] in FINISHED_STATUSES:
+            continue
+        # A paused job waits for someone to resume it, but not forever
+        if job['status'] == "paused" and now - job['updated_at'] > ttl:
+            continue
+        pinned.add(job['id'])
+        pinned.add(job['params'].get('source_job'))
+    finished = [job for job in jobs if job['kind'] == "generate" and job['status'] in FINISHED_STATUSES]
+    newest = finished[-1]['id'] if finished else None
+
+    candidates = [(job, job_disk_bytes(job, root)) for job in jobs if job['id'] not in pinned]
+    cache = cache_entries(cache_dir) if cache_dir else []
+    used = sum(size for _, size in candidates) + sum(size for _, _, size, _ in cache)
+    evicted = []
+    kept = deque()
+    for job, size in candidates:
+        if now - job['updated_at'] > ttl:
+            delete_job(store, job['id'], root)
+            used -= size
+            evicted.append(job['id'])
+        elif job['id'] != newest:
+            kept.append((job, size))
+
+    cache = deque(cache)
+    while cache or kept:
+        if cache:
+            mtime, path, size, _ = cache[0]
+            if used <= quota and now - mtime <= ttl:
+                # Entries are in mtime order, so no later one has expired either
+                cache.clear()
+                continue
+            cache.popleft()
+            if _evict_cache_entry(path):
+                used -= size
+            continue
+        if used <= quota:
+            break
+        job, size = kept.popleft()
+        delete_job(store, job['id'], root)
+        used -= size
+        evicted.append(job['id'])
+        # Cache entries only this job linked to can go now
+        cache = deque(entry for entry in cache_entries(cache_dir) if entry[3] == 1) if cache_dir else deque()
+
+    # Directories whose job is gone, e.g. after a crash while a job was being submitted
+    known = {job['id'] for job in jobs}
+    if os.path.isdir(root):
+        for entry in os.scandir(root):
+            if entry.is_dir() and entry.name not in known and now - entry.stat().st_mtime > ttl:
+                shutil.rmtree(entry.path, ignore_errors=True)
+    return evicted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run or inspect queued certificate jobs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("worker", help="Process queued generation jobs until interrupted")
+    status_parser = subparsers.add_parser("status", help="Show a job's progress")
+    status_parser.add_argument("job_id")
+    subparsers.add_parser("list", help="List recent jobs")
+    subparsers.add_parser("sweep", help="Delete expired jobs and enforce the disk quota now")
+    args = parser.parse_args(argv)
+
+    store = JobStore()
+    if args.command == "worker":
+        # Email jobs need a password that is never stored, so only generation runs here
+        runner = JobRunner(store, kinds=("generate",)).start()
+        print(f"Processing jobs from {store.path} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            runner.stop()
+    elif args.command == "status":
+        job = store.get_job(args.job_id)
+        if job is None:
+            print(f"No job {args.job_id}")
+            return 1
+        print(f"{job['kind']} job {job['id']}: {job['status']} {store.row_counts(job['id'])}")
+        if job['error']:
+            print(job['error'])
+    elif args.command == "sweep":
+        evicted = evict_jobs(store)
+        print(f"Evicted {len(evicted)} jobs")
+    else:
+        for job in store.list_jobs():
+            print(f"{job['id']}  {job['kind']:<8}  {job['status']:<8}  {store.row_counts(job['id'])}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,428 @@
+"""Email delivery for certificates.
+
+SMTPMailer keeps authenticated SMTP connections open and reuses them across
+messages, so a bulk send pays for the TLS handshake and login once per
+connection instead of once per recipient. Dropped connections are reopened
+transparently.
+
+EmailDispatcher sends through a mailer from several worker threads, paced by
+token buckets (messages per second/minute) and an optional daily quota, and
+backing off when the server answers with a throttling reply, whether to the
+message or to its recipient.
+
+Where mail goes is set by SMTPSettings: any SMTP relay (SSL, STARTTLS or
+plain), or a "file" backend that writes each message as an .eml file so the
+send path can be load-tested offline. smtp_sink.py provides a local SMTP
+server for the same purpose.
+"""
+import os
+import queue
+import re
+import smtplib
+import ssl
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pandas as pd
+
+import metrics
+
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 465
+
+SECURITY_MODES = ("ssl", "starttls", "none")
+BACKENDS = ("smtp", "file")
+
+# SMTP replies that mean "slow down and try again later"
+THROTTLE_CODES = (421, 450, 451)
+
+
+# Function to get the reply codes a server refused a message's recipients with
+def refused_codes(error):
+    return {code for code, _ in error.recipients.values()}
+
+
+EMAIL_PATTERN = r'^[\w\.-]+@[\w\.-]+\.\w+$'
+
+
+# Function to validate email
+def is_valid_email(email):
+    if not email or pd.isna(email):
+        return False
+    return re.match(EMAIL_PATTERN, str(email)) is not None
+
+
+# Function to validate a whole column of emails at once (True where valid)
+def valid_email_mask(emails):
+    return emails.notna() & emails.astype(str).str.match(EMAIL_PATTERN)
+
+
+@dataclass
+class SMTPSettings:
+    backend: str = "smtp"
+    host: str = SMTP_HOST
+    port: int = SMTP_PORT
+    security: str = "ssl"
+    sink_dir: str = "outbox"
+
+    # Function to read settings from SMTP_* environment variables
+    @classmethod
+    def from_env(cls):
+        defaults = cls()
+        return cls(
+            backend=os.environ.get("SMTP_BACKEND", defaults.backend),
+            host=os.environ.get("SMTP_HOST", defaults.host),
+            port=int(os.environ.get("SMTP_PORT", defaults.port)),
+            security=os.environ.get("SMTP_SECURITY", defaults.security),
+            sink_dir=os.environ.get("SMTP_SINK_DIR", defaults.sink_dir),
+        )
+
+    # Whether this transport needs a login (local relays and file sinks don't)
+    @property
+    def requires_login(self):
+        return self.backend == "smtp" and self.security != "none"
+
+
+class FileSinkConnection:
+    # Stand-in for an SMTP connection that writes each message to an .eml file
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send_message(self, msg):
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}.eml")
+        with open(path, "wb") as eml_file:
+            eml_file.write(msg.as_bytes())
+        return {}
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Function to open a connection for the configured backend
+# Login only happens over an encrypted connection (settings.requires_login), so a
+# password kept from another provider never goes to a plaintext relay or sink.
+def open_connection(settings, sender_email, password, timeout=30):
+    if settings.backend == "file":
+        return FileSinkConnection(settings.sink_dir)
+    if settings.backend != "smtp":
+        raise ValueError(f"Unknown email backend: {settings.backend}")
+
+    if settings.security == "ssl":
+        context = ssl.create_default_context()
+        server = smtplib.SMTP_SSL(settings.host, settings.port, context=context, timeout=timeout)
+    else:
+        server = smtplib.SMTP(settings.host, settings.port, timeout=timeout)
+    try:
+        if settings.security == "starttls":
+            server.starttls(context=ssl.create_default_context())
+        if password and settings.requires_login:
+            server.login(sender_email, password)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+# Function to turn a send failure into the message shown in the UI
+def describe_send_error(error):
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return "Authentication failed. Check your email and app password."
+    return f"Error sending email: {str(error)}"
+
+
+# Function to build a message with an optional attachment
+def build_message(sender_email, recipient_email, subject, body, attachment_path=None):
+    msg = MIMEMultipart()
+    msg['From'] = sender_email
+    msg['To'] = recipient_email
+    msg['Subject'] = subject
+
+    # Add body text
+    msg.attach(MIMEText(body, 'plain'))
+
+    # Add attachment if provided
+    if attachment_path and os.path.exists(attachment_path):
+        attachment_filename = os.path.basename(attachment_path)
+        with open(attachment_path, 'rb') as file:
+            attachment = MIMEApplication(file.read(), Name=attachment_filename)
+            attachment['Content-Disposition'] = f'attachment; filename="{attachment_filename}"'
+            msg.attach(attachment)
+    return msg
+
+
+class SMTPMailer:
+    # pipeline_metrics, if given, collects smtp_connect and smtp_send timings
+    def __init__(self, sender_email, password, pool_size=1, timeout=30, settings=None, pipeline_metrics=None):
+        self.sender_email = sender_email
+        self.password = password
+        self.settings = settings or SMTPSettings()
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.pipeline_metrics = pipeline_metrics
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Function to open and authenticate a new connection
+    def _connect(self):
+        with metrics.stage("smtp_connect", self.pipeline_metrics):
+            return open_connection(self.settings, self.sender_email, self.password, self.timeout)
+
+    # Function to borrow a connection, opening one if the pool has room
+    def _acquire(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                if self._opened < self.pool_size:
+                    self._opened += 1
+                    break
+            # Pool is full; wait for a connection to be released or discarded
+            try:
+                return self._idle.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _release(self, server):
+        self._idle.put(server)
+
+    # Function to drop a broken connection so the pool can open a new one
+    def _discard(self, server):
+        try:
+            server.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    # Function to send on one pooled connection, returning it to the pool afterwards
+    def _send_once(self, msg):
+        server = self._acquire()
+        try:
+            with metrics.stage("smtp_send", self.pipeline_metrics):
+                server.send_message(msg)
+        except smtplib.SMTPRecipientsRefused as e:
+            # 421 means the server is closing this connection
+            if 421 in refused_codes(e):
+                self._discard(server)
+            else:
+                self._release(server)
+            raise
+        except smtplib.SMTPResponseException as e:
+            # 421 means the server is closing this connection
+            if e.smtp_code == 421:
+                self._discard(server)
+            else:
+                self._release(server)
+            raise
+        except Exception:
+            self._discard(server)
+            raise
+        self._release(server)
+
+    # Function to close every idle connection so the next send opens a fresh one
+    def _drop_idle(self):
+        while True:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(server)
+
+    # Function to send a prepared message, reconnecting once if the server hung up
+    # A server that dropped one idle connection has usually timed out the others
+    # too, so the retry goes out on a newly opened connection.
+    def send_message(self, msg):
+        try:
+            self._send_once(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self._drop_idle()
+            self._send_once(msg)
+
+    # Function to send a certificate, returning (success, message) like send_email
+    def send(self, recipient_email, subject, body, attachment_path=None):
+        try:
+            if not recipient_email:
+                return False, "Missing required email parameters"
+            if not is_valid_email(self.sender_email) or not is_valid_email(recipient_email):
+                return False, "Invalid email address format"
+
+            msg = build_message(self.sender_email, recipient_email, subject, body, attachment_path)
+            self.send_message(msg)
+            return True, "Email sent successfully"
+        except Exception as e:
+            return False, describe_send_error(e)
+
+    # Function to log out of every idle connection
+    def close(self):
+        while True:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                server.quit()
+            except Exception:
+                server.close()
+            with self._lock:
+                self._opened -= 1
+
+
+class TokenBucket:
+    def __init__(self, rate, period=1.0):
+        # rate tokens are added every period seconds; bursts are capped at rate
+        self.capacity = float(rate)
+        self.fill_rate = rate / period
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Function to take one token, waiting at most timeout seconds for it
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                delay = (1 - self.tokens) / self.fill_rate
+            if deadline is not None and now + delay > deadline:
+                return False
+            time.sleep(delay)
+
+
+class RateLimiter:
+    def __init__(self, per_second=None, per_minute=None, per_day=None):
+        self.buckets = []
+        if per_day:
+            self.buckets.append(TokenBucket(per_day, 86400))
+        if per_minute:
+            self.buckets.append(TokenBucket(per_minute, 60))
+        if per_second:
+            self.buckets.append(TokenBucket(per_second, 1))
+
+    def acquire(self, timeout=None):
+        return all(bucket.acquire(timeout) for bucket in self.buckets)
+
+
+class EmailDispatcher:
+    # Every attempt is paced by the per-second/minute buckets; the daily allowance is
+    # charged once per message, after pacing, so throttled retries don't use it up.
+    # daily_quota is anything with acquire(timeout) that counts sends outside this
+    # process, e.g. jobs.DailySendQuota; per_day alone only limits this dispatcher.
+    def __init__(self, mailer, workers=4, per_second=None, per_minute=None, per_day=None,
+                 max_retries=5, backoff=2.0, max_backoff=60.0, quota_timeout=300, daily_quota=None):
+        self.mailer = mailer
+        self.workers = max(1, workers)
+        self.limiter = RateLimiter(per_second, per_minute)
+        if daily_quota is None and per_day:
+            daily_quota = TokenBucket(per_day, 86400)
+        self.daily_quota = daily_quota
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.quota_timeout = quota_timeout
+
+    # Function to send one job, backing off on throttling replies
+    def _deliver(self, job):
+        recipient_email, subject, body, attachment_path = job[:4]
+        if not is_valid_email(recipient_email):
+            return job, False, "Invalid email format"
+
+        msg = build_message(self.mailer.sender_email, recipient_email, subject, body, attachment_path)
+        charged = self.daily_quota is None
+        for attempt in range(self.max_retries + 1):
+            if not self.limiter.acquire(self.quota_timeout):
+                return job, False, "Sending quota reached. Retry later."
+            if not charged:
+                if not self.daily_quota.acquire(self.quota_timeout):
+                    return job, False, "Sending quota reached. Retry later."
+                charged = True
+            try:
+                self.mailer.send_message(msg)
+                return job, True, "Email sent successfully"
+            except smtplib.SMTPAuthenticationError as e:
+                return job, False, describe_send_error(e)
+            except smtplib.SMTPRecipientsRefused as e:
+                # A throttled RCPT (e.g. 450 while the server rate-limits) is retried like any other
+                if not refused_codes(e) <= set(THROTTLE_CODES) or attempt == self.max_retries:
+                    return job, False, describe_send_error(e)
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code not in THROTTLE_CODES or attempt == self.max_retries:
+                    return job, False, describe_send_error(e)
+            except Exception as e:
+                return job, False, describe_send_error(e)
+            time.sleep(min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    # Function to send every (recipient, subject, body, attachment, ...) job
+    # Yields (job, success, message) in the calling thread as each send completes, so the
+    # caller can update progress; anything after the attachment (e.g. a row index) is
+    # passed through untouched. At most workers * 4 jobs are queued at a time.
+    def dispatch(self, jobs):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = set()
+            for job in jobs:
+                pending.add(executor.submit(self._deliver, job))
+                if len(pending) >= self.workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+
+# Function to test email connection
+def test_email_connection(email, password, settings=None):
+    try:
+        server = open_connection(settings or SMTPSettings(), email, password)
+        server.quit()
+        return True, "Connection successful"
+    except smtplib.SMTPAuthenticationError:
+        return False, "Authentication failed. Check your email and app password."
+    except smtplib.SMTPException as e:
+        return False, f"SMTP error: {str(e)}"
+    except Exception as e:
+        return False, f"Connection error: {str(e)}"
+
+
+# Function to send an email with attachment
+# Pass a mailer to reuse its open connection; otherwise a one-off connection is used.
+def send_email(sender_email, password, recipient_email, subject, body, attachment_path=None,
+               mailer=None, settings=None):
+    if settings is None:
+        settings = mailer.settings if mailer is not None else SMTPSettings()
+    if not all([sender_email, recipient_email]) or (settings.requires_login and not password):
+        return False, "Missing required email parameters"
+    if mailer is not None:
+        return mailer.send(recipient_email, subject, body, attachment_path)
+    with SMTPMailer(sender_email, password, settings=settings) as one_off:
+        return one_off.send(recipient_email, subject, body, attachment_path)
@@ -0,0 +1,210 @@
+"""Per-stage timing and throughput for the certificate pipeline.
+
+Code on the hot path wraps each stage in `stage()`: ingest, font load, draw,
+encode, QR stamp, zip write, SMTP connect and SMTP send. Stages that run
+inside render workers are added up per thread and collected with `drain()`
+once per certificate, so they travel back to the parent with each render
+result. A PipelineMetrics object for a run then aggregates these timings
+into a per-stage latency distribution, rows/sec and peak RSS. Its summary is a
+plain dict that can be shown in the app, stored with a job, or exported as
+JSON or Prometheus text.
+"""
+import json
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = (
+    "ingest", "font_load", "draw", "encode", "qr_stamp", "render", "zip_write", "smtp_connect", "smtp_send",
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Stage times observed by the current thread that no PipelineMetrics has collected yet
+_pending = threading.local()
+
+
+# Function to add time spent in a stage by this thread, collected later with drain()
+def observe(stage_name, seconds):
+    timings = getattr(_pending, "timings", None)
+    if timings is None:
+        timings = _pending.timings = {}
+    timings[stage_name] = timings.get(stage_name, 0.0) + seconds
+
+
+# Function to take the stage times this thread observed since the last drain
+def drain():
+    timings = getattr(_pending, "timings", None) or {}
+    _pending.timings = {}
+    return timings
+
+
+# Function to time a block as a stage, into metrics if given, otherwise for drain()
+@contextmanager
+def stage(stage_name, metrics=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if metrics is None:
+            observe(stage_name, elapsed)
+        else:
+            metrics.observe(stage_name, elapsed)
+
+
+# Function to get this process's peak resident set size in bytes (None where unsupported)
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PipelineMetrics:
+    # Stage latency samples and throughput for one run; safe to update from several threads
+    # latency_stage is the stage reported as the run's per-row latency.
+    def __init__(self, latency_stage="render"):
+        self.latency_stage = latency_stage
+        self.rows = 0
+        self.started = None
+        self.finished = None
+        self.worker_peak_rss = None
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    # Function to mark the start of the timed run (the first row starts it otherwise)
+    def start(self):
+        self.finished = None
+        if self.started is None:
+            self.started = time.time()
+
+    def finish(self):
+        self.finished = time.time()
+
+    def observe(self, stage_name, seconds):
+        with self._lock:
+            samples = self._samples.get(stage_name)
+            if samples is None:
+                samples = self._samples[stage_name] = array("d")
+            samples.append(seconds)
+
+    # Function to count processed rows, e.g. emails sent
+    def count(self, rows=1):
+        self.start()
+        with self._lock:
+            self.rows += rows
+
+    # Function to record one render result: its stage timings and its worker's peak RSS
+    def add_result(self, result):
+        for stage_name, seconds in (result.get('timings') or {}).items():
+            self.observe(stage_name, seconds)
+        worker_rss = result.get('peak_rss')
+        if worker_rss is not None:
+            with self._lock:
+                self.worker_peak_rss = max(self.worker_peak_rss or 0, worker_rss)
+        self.count()
+
+    # Function to add another run's samples, e.g. ingest timed before a job was queued
+    def merge(self, other):
+        with other._lock:
+            samples = {stage_name: array("d", values) for stage_name, values in other._samples.items()}
+        for stage_name, values in samples.items():
+            with self._lock:
+                self._samples.setdefault(stage_name, array("d")).extend(values)
+
+    # Function to pass items through, timing how long each one took to produce as a stage
+    def timed(self, iterable, stage_name):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(stage_name, time.perf_counter() - start)
+            yield item
+
+    # Function to summarize the run as a plain, JSON-serializable dict
+    def summary(self):
+        with self._lock:
+            samples = {stage_name: np.frombuffer(values, dtype=np.float64).copy()
+                       for stage_name, values in self._samples.items() if len(values)}
+            rows = self.rows
+        end = self.finished or time.time()
+        seconds = end - self.started if self.started else 0.0
+
+        stages = {}
+        for stage_name in sorted(samples, key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES)):
+            values = samples[stage_name]
+            quantiles = np.quantile(values, QUANTILES)
+            stages[stage_name] = {
+                'count': int(len(values)),
+                'total_seconds': float(values.sum()),
+                'mean_ms': float(values.mean() * 1000),
+                **{f"p{round(q * 100)}_ms": float(v * 1000) for q, v in zip(QUANTILES, quantiles)},
+            }
+
+        latency = stages.get(self.latency_stage, {})
+        return {
+            'rows': rows,
+            'seconds': seconds,
+            'rows_per_sec': rows / seconds if seconds > 0 else 0.0,
+            'latency_stage': self.latency_stage,
+            'latency_ms': {key: latency[f"{key}_ms"] for key in ("p50", "p95", "p99") if f"{key}_ms" in latency},
+            'peak_rss_bytes': peak_rss(),
+            'worker_peak_rss_bytes': self.worker_peak_rss,
+            'stages': stages,
+        }
+
+
+# Function to export a summary as JSON
+def to_json(summary):
+    return json.dumps(summary, indent=2)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+# Function to export a summary in the Prometheus text exposition format
+# labels (e.g. {'job': job_id}) are added to every sample.
+def to_prometheus(summary, labels=None):
+    labels = dict(labels or {})
+    lines = [
+        "# HELP certificate_stage_seconds Time spent per certificate pipeline stage.",
+        "# TYPE certificate_stage_seconds summary",
+    ]
+    for stage_name, stats in summary['stages'].items():
+        stage_labels = dict(labels, stage=stage_name)
+        for quantile in QUANTILES:
+            value = stats[f"p{round(quantile * 100)}_ms"] / 1000
+            lines.append(f"certificate_stage_seconds{_labels(dict(stage_labels, quantile=quantile))} {value:.9g}")
+        lines.append(f"certificate_stage_seconds_sum{_labels(stage_labels)} {stats['total_seconds']:.9g}")
+        lines.append(f"certificate_stage_seconds_count{_labels(stage_labels)} {stats['count']}")
+
+    gauges = [
+        ("certificate_rows", "Rows processed in the run.", summary['rows']),
+        ("certificate_rows_per_second", "Rows processed per second.", summary['rows_per_sec']),
+        ("certificate_peak_rss_bytes", "Peak resident memory of the coordinating process.", summary['peak_rss_bytes']),
+        ("certificate_worker_peak_rss_bytes", "Peak resident memory of any render worker.",
+         summary['worker_peak_rss_bytes']),
+    ]
+    for name, help_text, value in gauges:
+        if value is None:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name}{_labels(labels)} {value:.9g}")
+    return "\n".join(lines) + "\n"
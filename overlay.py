@@ -0,0 +1,203 @@
+"""Template-plus-overlay PNG encoding.
+
+Only the horizontal bands of the template that text can touch differ between
+certificates. OverlayPNGEncoder compresses every other row of the template
+once, as ready-made IDAT chunks, and for each certificate renders and
+compresses just the text bands, then splices the pieces into one valid PNG.
+Rendering and encoding cost therefore scales with the text area instead of
+the whole page, and the output is pixel-identical to drawing on the full
+template.
+
+Rows are written with PNG's Sub filter, which only looks at the same row, so
+the static bands don't depend on the rows around them. Each band is its own
+raw deflate segment ending on a flush boundary, and the zlib Adler-32 trailer
+is combined from per-band checksums. Because the static bands are compressed
+only once, they use a stronger zlib level than the per-certificate bands.
+"""
+import struct
+import zlib
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import metrics
+from fonts import get_font
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+COLOR_TYPES = {"RGB": 2, "RGBA": 6}
+
+ADLER_BASE = 65521
+
+# zlib level for the bands shared by every certificate, which are compressed once
+STATIC_COMPRESS_LEVEL = 6
+
+
+# Function to combine two Adler-32 checksums (zlib's adler32_combine)
+def adler32_combine(adler1, adler2, length2):
+    remainder = length2 % ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (remainder * sum1) % ADLER_BASE
+    sum1 += (adler2 & 0xFFFF) + ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xFFFF) + ((adler2 >> 16) & 0xFFFF) + ADLER_BASE - remainder
+    return (sum1 % ADLER_BASE) | ((sum2 % ADLER_BASE) << 16)
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+# Function to sort row ranges and merge the ones that overlap or touch
+def merge_bands(bands):
+    merged = []
+    for top, bottom in sorted(bands):
+        if merged and top <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], bottom))
+        else:
+            merged.append((top, bottom))
+    return merged
+
+
+# Function to measure the distance between the lines of multiline text in a font
+# Taken from Pillow's own multiline layout, so bands match what draw.text produces.
+@lru_cache(maxsize=256)
+def line_spacing(font_size, face=None):
+    draw = ImageDraw.Draw(Image.new("L", (1, 1)))
+    font = get_font(font_size, face)
+    return draw.multiline_textbbox((0, 0), "A\nA", font=font)[3] - draw.textbbox((0, 0), "A", font=font)[3]
+
+
+# Function to compute the row ranges text can touch, as (top, bottom) pairs
+# Fields are drawn with anchor="mm", so each line spans its font's ascender to
+# descender, and a block of several lines is centred on actual_y; a margin covers
+# overhanging glyphs. Bands depend on the number of lines but not on the text
+# itself, so certificates with the same line counts share one pre-encoded layout.
+def text_bands(text_elements, height, texts=None):
+    bands = []
+    for element, text in zip(text_elements, texts or [None] * len(text_elements)):
+        ascent, descent = get_font(element['font_size'], element.get('font')).getmetrics()
+        margin = max(2, element['font_size'] // 4)
+        half = (ascent + descent) / 2
+        if text and "\n" in text:
+            half += text.count("\n") * line_spacing(element['font_size'], element.get('font')) / 2
+        top = max(0, int(element['actual_y'] - half) - margin)
+        bottom = min(height, int(element['actual_y'] + half) + margin + 1)
+        if top < bottom:
+            bands.append((top, bottom))
+    return merge_bands(bands)
+
+
+class OverlayPNGEncoder:
+    # A template with its static rows pre-encoded, writing PNGs that differ only in the text bands
+    def __init__(self, template_image, compress_level=6):
+        if template_image.mode not in COLOR_TYPES:
+            template_image = template_image.convert("RGB")
+        self.template = template_image
+        self.compress_level = compress_level
+        self.bytes_per_pixel = len(template_image.mode)
+        self.header = PNG_SIGNATURE + _chunk(b"IHDR", struct.pack(
+            ">IIBBBBB", template_image.width, template_image.height, 8, COLOR_TYPES[template_image.mode], 0, 0, 0
+        ))
+        # Static segments per band layout; a batch normally uses a single layout
+        self._layouts = {}
+
+    # Function to PNG-filter rows of an image with the Sub filter
+    def _filter_rows(self, image):
+        bpp = self.bytes_per_pixel
+        rows = np.frombuffer(image.tobytes(), dtype=np.uint8).reshape(image.height, image.width * bpp)
+        filtered = np.empty((image.height, rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 1
+        filtered[:, 1:bpp + 1] = rows[:, :bpp]
+        np.subtract(rows[:, bpp:], rows[:, :-bpp], out=filtered[:, bpp + 1:])
+        return filtered.tobytes()
+
+    # Function to compress one band as a raw deflate segment
+    def _compress(self, raw, last, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        flush_mode = zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH
+        return compressor.compress(raw) + compressor.flush(flush_mode)
+
+    # Function to split the page into static and text segments and pre-encode the static ones
+    def _layout(self, bands):
+        key = tuple(bands)
+        if key in self._layouts:
+            return self._layouts[key]
+
+        height = self.template.height
+        segments = []
+        row = 0
+        for top, bottom in list(bands) + [(height, height)]:
+            if row < top:
+                segments.append({'rows': (row, top), 'static': True})
+            if top < bottom:
+                segments.append({'rows': (top, bottom), 'static': False})
+            row = bottom
+
+        for position, segment in enumerate(segments):
+            if segment['static']:
+                top, bottom = segment['rows']
+                raw = self._filter_rows(self.template.crop((0, top, self.template.width, bottom)))
+                data = self._compress(
+                    raw, position == len(segments) - 1, max(self.compress_level, STATIC_COMPRESS_LEVEL)
+                )
+                if position == 0:
+                    data = b"\x78\x01" + data
+                segment['chunk'] = _chunk(b"IDAT", data)
+                segment['adler'] = zlib.adler32(raw)
+                segment['length'] = len(raw)
+        self._layouts[key] = segments
+        return segments
+
+    # Function to render the texts and return the finished PNG bytes
+    # stamps are (image, (x, y)) pairs pasted over the text, e.g. a QR code.
+    def encode(self, text_elements, texts, stamps=()):
+        height = self.template.height
+        bands = text_bands(text_elements, height, texts) + [
+            (max(0, y), min(height, y + image.height)) for image, (x, y) in stamps
+        ]
+        segments = self._layout(merge_bands(bands))
+        parts = [self.header]
+        adler = 1
+        for position, segment in enumerate(segments):
+            last = position == len(segments) - 1
+            if segment['static']:
+                parts.append(segment['chunk'])
+                adler = adler32_combine(adler, segment['adler'], segment['length'])
+                continue
+
+            top, bottom = segment['rows']
+            with metrics.stage("draw"):
+                band = self.template.crop((0, top, self.template.width, bottom))
+                draw = ImageDraw.Draw(band)
+                for element, text in zip(text_elements, texts):
+                    if text is None:
+                        continue
+                    draw.text(
+                        (element['actual_x'], element['actual_y'] - top),
+                        text,
+                        fill=element['color'],
+                        font=get_font(element['font_size'], element.get('font')),
+                        anchor="mm"
+                    )
+                for image, (x, y) in stamps:
+                    band.paste(image, (x, y - top))
+            with metrics.stage("encode"):
+                raw = self._filter_rows(band)
+                data = self._compress(raw, last, self.compress_level)
+                if position == 0:
+                    data = b"\x78\x01" + data
+                parts.append(_chunk(b"IDAT", data))
+                adler = adler32_combine(adler, zlib.adler32(raw), len(raw))
+
+        parts.append(_chunk(b"IDAT", struct.pack(">I", adler)))
+        parts.append(_chunk(b"IEND", b""))
+        return b"".join(parts)
+
+    # Function to write a certificate to a path or file object
+    def write(self, destination, text_elements, texts, stamps=()):
+        data = self.encode(text_elements, texts, stamps)
+        if hasattr(destination, "write"):
+            destination.write(data)
+        else:
+            with open(destination, "wb") as png_file:
+                png_file.write(data)
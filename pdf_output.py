@@ -0,0 +1,167 @@
+"""Vector PDF output for certificates.
+
+The template is encoded once per run (as a JPEG image XObject) and every text field
+is drawn as real, selectable vector text at the same positions as the PNG
+renderer, so a certificate PDF is the size of the compressed template plus a
+few hundred bytes per page. write_merged() puts many certificates into one
+print-ready document in which the template XObject is stored only once.
+Validation QR codes are drawn as vector squares, so they print sharp at any size.
+
+Needs the optional 'reportlab' package.
+"""
+import importlib.util
+import io
+import os
+import tempfile
+import weakref
+from functools import lru_cache
+
+from PIL import Image
+
+import metrics
+import qr_stamp
+from fonts import get_font, resolve_face
+
+# Resolution assumed for templates that don't record one
+DEFAULT_DPI = 300
+
+# Quality of the embedded template image
+TEMPLATE_JPEG_QUALITY = 90
+
+FALLBACK_PDF_FONT = "Helvetica"
+
+
+# Function to check whether PDF output can be written here
+def available():
+    return importlib.util.find_spec("reportlab") is not None
+
+
+def _require_reportlab():
+    try:
+        from reportlab import rl_config
+    except ImportError:
+        raise ValueError("PDF output requires the 'reportlab' package")
+    # Write binary streams: ASCII85 makes the embedded template a quarter larger
+    # and, without reportlab's C accelerator, costs more than the page itself
+    rl_config.useA85 = 0
+
+
+# Function to register a TrueType face with reportlab once, returning its PDF font name
+@lru_cache(maxsize=None)
+def pdf_font_name(face=None):
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    path = resolve_face(face)
+    if path is None:
+        return FALLBACK_PDF_FONT
+    name = f"CertificateFont{len(pdfmetrics.getRegisteredFontNames())}"
+    try:
+        pdfmetrics.registerFont(TTFont(name, path))
+    except Exception:
+        return FALLBACK_PDF_FONT
+    return name
+
+
+class PDFTemplate:
+    # A decoded template prepared once for writing PDF pages
+    def __init__(self, template_image, dpi=None):
+        _require_reportlab()
+        self.size = template_image.size
+        if dpi is None:
+            dpi = template_image.info.get("dpi", (DEFAULT_DPI,))[0] or DEFAULT_DPI
+        # Points per template pixel
+        self.scale = 72.0 / float(dpi)
+        self.page_size = (self.size[0] * self.scale, self.size[1] * self.scale)
+
+        if template_image.mode == "RGBA":
+            flattened = Image.new("RGB", template_image.size, "white")
+            flattened.paste(template_image, mask=template_image.getchannel("A"))
+            template_image = flattened
+        buffer = io.BytesIO()
+        template_image.convert("RGB").save(buffer, format="JPEG", quality=TEMPLATE_JPEG_QUALITY)
+        self.jpeg = buffer.getvalue()
+
+        # reportlab embeds a JPEG file as-is; an in-memory image would be decoded
+        # again on every document just to fingerprint it
+        handle, self.jpeg_path = tempfile.mkstemp(suffix=".jpg", prefix="certificate-template-")
+        with os.fdopen(handle, "wb") as jpeg_file:
+            jpeg_file.write(self.jpeg)
+        weakref.finalize(self, os.remove, self.jpeg_path)
+
+    # Function to draw a QR code as filled squares, one rectangle per run of dark modules
+    def _draw_qr(self, pdf, qr_data):
+        with metrics.stage("qr_stamp"):
+            matrix = qr_stamp.qr_matrix(qr_data)
+        module = qr_stamp.module_size(len(matrix))
+        side = module * len(matrix)
+        left, top = qr_stamp.qr_position(self.size, side)
+
+        # Clear the quiet zone, then fill the dark modules as a single path
+        pdf.setFillColorRGB(1, 1, 1)
+        pdf.rect(left * self.scale, (self.size[1] - top - side) * self.scale, side * self.scale, side * self.scale,
+                 stroke=0, fill=1)
+        path = pdf.beginPath()
+        for row, cells in enumerate(matrix):
+            y = (self.size[1] - top - (row + 1) * module) * self.scale
+            column = 0
+            while column < len(cells):
+                if not cells[column]:
+                    column += 1
+                    continue
+                start = column
+                while column < len(cells) and cells[column]:
+                    column += 1
+                path.rect((left + start * module) * self.scale, y, (column - start) * module * self.scale,
+                          module * self.scale)
+        pdf.setFillColorRGB(0, 0, 0)
+        pdf.drawPath(path, stroke=0, fill=1)
+
+    # Function to draw one certificate page onto a reportlab canvas
+    def _draw_page(self, pdf, text_elements, texts, qr_data=None):
+        from reportlab.lib.colors import toColor
+
+        pdf.drawImage(self.jpeg_path, 0, 0, width=self.page_size[0], height=self.page_size[1])
+        for element, text in zip(text_elements, texts):
+            if text is None:
+                continue
+            # Match the PNG renderer's anchor="mm": centred horizontally, and
+            # vertically halfway between the font's ascender and descender
+            ascent, descent = get_font(element['font_size'], element.get('font')).getmetrics()
+            baseline = element['actual_y'] + (ascent - descent) / 2
+            pdf.setFillColor(toColor(element['color']))
+            pdf.setFont(pdf_font_name(element.get('font')), element['font_size'] * self.scale)
+            pdf.drawCentredString(
+                element['actual_x'] * self.scale,
+                (self.size[1] - baseline) * self.scale,
+                text
+            )
+        if qr_data:
+            self._draw_qr(pdf, qr_data)
+        pdf.showPage()
+
+    # Function to write certificates as pages of one PDF
+    # pages is an iterable of (texts, qr_data) pairs; qr_data is None for no QR code.
+    def write_pages(self, destination, text_elements, pages):
+        from reportlab.pdfgen import canvas
+
+        pdf = canvas.Canvas(destination, pagesize=self.page_size, pageCompression=1)
+        pdf.setTitle("Certificates")
+        # Every page draws the same image file, so the template is embedded once
+        count = 0
+        for texts, qr_data in pages:
+            with metrics.stage("draw"):
+                self._draw_page(pdf, text_elements, texts, qr_data)
+            count += 1
+        with metrics.stage("encode"):
+            pdf.save()
+        return count
+
+    # Function to write a single certificate
+    def write(self, destination, text_elements, texts, qr_data=None):
+        self.write_pages(destination, text_elements, [(texts, qr_data)])
+
+
+# Function to build one merged, print-ready PDF from the (texts, qr_data) pairs of many certificates
+def write_merged(template_image, text_elements, pages, destination, dpi=None):
+    return PDFTemplate(template_image, dpi).write_pages(destination, text_elements, pages)
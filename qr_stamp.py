@@ -0,0 +1,57 @@
+"""Validation QR codes for certificates.
+
+QR codes are drawn straight from the code's module matrix at a whole number of
+pixels per module, so they stay sharp at the target size instead of being
+resized with resampling blur. The render pipeline stamps them before a
+certificate is first encoded (see certificate_engine.render_record), and PDFs
+draw the same matrix as vector squares. Certificate IDs come from registry.py.
+"""
+import numpy as np
+import qrcode
+from PIL import Image
+
+# Link encoded in each QR code; {cert_id} is replaced by the certificate's ID
+QR_URL = "https://your-validation-url.com/validate?cert_id={cert_id}"
+
+# Largest side of the QR code and its distance from the bottom-right corner, in template pixels
+QR_SIZE = 150
+QR_MARGIN = 10
+
+# Quiet zone around the code, in modules
+QR_BORDER = 4
+
+# Fixed data mask. Scoring all eight masks is most of the cost of building a code in
+# pure Python (about 25 ms); any mask is valid, and for high-entropy payloads like
+# certificate IDs the scores barely differ.
+QR_MASK_PATTERN = 2
+
+
+# Function to fill a certificate ID into the validation URL
+def qr_payload(url, certificate_id):
+    return url.replace("{cert_id}", certificate_id)
+
+
+# Function to build the QR module matrix (True = dark), quiet zone included
+def qr_matrix(data, border=QR_BORDER):
+    code = qrcode.QRCode(border=border, mask_pattern=QR_MASK_PATTERN)
+    code.add_data(data)
+    code.make(fit=True)
+    return code.get_matrix()
+
+
+# Function to pick the whole number of pixels per module that fits in size
+def module_size(modules, size=QR_SIZE):
+    return max(1, size // modules)
+
+
+# Function to find the top-left corner of a QR code of the given side
+def qr_position(image_size, side, margin=QR_MARGIN):
+    return image_size[0] - margin - side, image_size[1] - margin - side
+
+
+# Function to render a QR code as a black-and-white image at most size pixels wide
+def qr_image(data, size=QR_SIZE):
+    matrix = np.array(qr_matrix(data), dtype=bool)
+    module = module_size(len(matrix), size)
+    pixels = np.where(matrix, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels.repeat(module, axis=0).repeat(module, axis=1))
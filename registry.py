@@ -0,0 +1,223 @@
+"""Offline registry of issued certificates.
+
+Certificate IDs are derived deterministically as an HMAC of the event and the
+participant's row (its texts, email and output filename), keyed with a secret that never leaves this machine. The
+same participant in the same event therefore always gets the same ID, and an
+ID cannot be forged without the key. Every issued certificate is recorded in
+a local SQLite registry with the participant, a SHA-256 of the output file and
+the issue time; the ID is the table's primary key, so checking a scanned code
+is a single index lookup however many certificates have been issued.
+
+    python registry.py verify cert_x7k2...        # or the full QR URL
+    python registry.py verify cert_x7k2... --file certificate.png
+    python registry.py stats
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+
+REGISTRY_DIR = os.environ.get("CERTIFICATE_REGISTRY_DIR", "certificate_registry")
+REGISTRY_PATH = os.environ.get("CERTIFICATE_REGISTRY_DB", os.path.join(REGISTRY_DIR, "certificates.db"))
+KEY_PATH = os.environ.get("CERTIFICATE_KEY_PATH", os.path.join(REGISTRY_DIR, "secret.key"))
+
+# Bytes of the HMAC kept in an ID (120 bits, 24 base32 characters)
+ID_BYTES = 15
+
+CERTIFICATE_ID_PATTERN = re.compile(r"cert_[a-z2-7]{24}(?![a-z2-7])")
+
+# Issued certificates written to the registry per transaction
+REGISTER_BATCH = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    certificate_id TEXT PRIMARY KEY,
+    event TEXT NOT NULL,
+    participant TEXT,
+    email TEXT,
+    filename TEXT,
+    image_sha256 TEXT,
+    issued_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+# Function to load the signing key: CERTIFICATE_SECRET_KEY, or a key file created on first use
+def load_secret_key(path=KEY_PATH):
+    secret = os.environ.get("CERTIFICATE_SECRET_KEY")
+    if secret:
+        return secret.encode("utf-8")
+    if not os.path.exists(path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # O_EXCL so two processes starting together can't both write a key
+        try:
+            handle = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(handle, "w") as key_file:
+                key_file.write(os.urandom(32).hex())
+    with open(path, encoding="ascii") as key_file:
+        return bytes.fromhex(key_file.read().strip())
+
+
+# Function to derive a certificate ID from the event and a render record
+# The output filename without its extension tells apart participants whose
+# certificates read the same (see prepare_records), whatever the output profile.
+def derive_certificate_id(key, event, record):
+    filename = record.get('filename')
+    stem = os.path.splitext(filename)[0] if filename else None
+    message = json.dumps([event, record.get('participant'), record['texts'], record.get('email'), stem],
+                         ensure_ascii=False)
+    digest = hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()
+    return "cert_" + base64.b32encode(digest[:ID_BYTES]).decode("ascii").lower()
+
+
+# Function to pull the certificate ID out of a scanned QR payload (a URL or a bare ID)
+# The ID may be a query parameter (?id=cert_...) or part of the path (/verify/cert_...).
+def parse_certificate_id(scanned):
+    scanned = scanned.strip()
+    match = CERTIFICATE_ID_PATTERN.search(scanned)
+    return match.group(0) if match else scanned
+
+
+# Function to hash a certificate file
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as certificate_file:
+        for block in iter(lambda: certificate_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CertificateRegistry:
+    # SQLite table of issued certificates, keyed by certificate ID
+    def __init__(self, path=REGISTRY_PATH, key=None):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._key = key
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    # Function to open a connection for one transaction
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # The signing key is only loaded when an ID is derived, not for lookups
+    @property
+    def key(self):
+        if self._key is None:
+            self._key = load_secret_key()
+        return self._key
+
+    # Function to derive the ID for a record issued at an event
+    def certificate_id(self, event, record):
+        return derive_certificate_id(self.key, event, record)
+
+    # Function to record issued certificates; re-issuing an ID updates its hash and time
+    def register(self, entries):
+        if not entries:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO certificates "
+                "(certificate_id, event, participant, email, filename, image_sha256, issued_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (entry['certificate_id'], entry['event'], entry.get('participant'), entry.get('email'),
+                     entry.get('filename'), entry.get('image_sha256'), entry.get('issued_at', now))
+                    for entry in entries
+                )
+            )
+
+    # Function to fetch one issued certificate by ID (a primary-key lookup)
+    def lookup(self, certificate_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM certificates WHERE certificate_id = ?", (certificate_id,)).fetchone()
+        return dict(row) if row else None
+
+    # Function to check a scanned code, and optionally that a file is the certificate that was issued
+    def verify(self, scanned, path=None):
+        certificate_id = parse_certificate_id(scanned)
+        record = self.lookup(certificate_id)
+        result = {'certificate_id': certificate_id, 'valid': record is not None, 'record': record}
+        if record is not None and path is not None:
+            result['file_matches'] = file_sha256(path) == record['image_sha256']
+        return result
+
+    # Function to count issued certificates per event
+    def stats(self):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT event, COUNT(*) AS n, MAX(issued_at) AS last_issued FROM certificates GROUP BY event"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+# Function to pass render results through, recording every certificate with an ID
+# Entries are written in batches, and whatever is pending when the stream stops.
+def record_results(registry, event, results, batch_size=REGISTER_BATCH):
+    pending = []
+    try:
+        for result in results:
+            if result.get('certificate_id'):
+                pending.append({
+                    'certificate_id': result['certificate_id'],
+                    'event': event,
+                    'participant': result.get('participant'),
+                    'email': result.get('email'),
+                    'filename': result['filename'],
+                    'image_sha256': result.get('image_sha256'),
+                })
+                if len(pending) >= batch_size:
+                    registry.register(pending)
+                    pending = []
+            yield result
+    finally:
+        registry.register(pending)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify certificates against the local registry.")
+    parser.add_argument("--db", default=REGISTRY_PATH, help="Registry database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    verify_parser = subparsers.add_parser("verify", help="Look up a certificate ID or scanned QR URL")
+    verify_parser.add_argument("certificate_id")
+    verify_parser.add_argument("--file", help="Also check that this file is the certificate that was issued")
+    subparsers.add_parser("stats", help="Show how many certificates each event issued")
+    args = parser.parse_args(argv)
+
+    registry = CertificateRegistry(args.db)
+    if args.command == "verify":
+        result = registry.verify(args.certificate_id, args.file)
+        print(json.dumps(result, indent=2))
+        return 0 if result['valid'] and result.get('file_matches', True) else 1
+
+    for row in registry.stats():
+        issued = time.strftime("%Y-%m-%d %H:%M", time.localtime(row['last_issued']))
+        print(f"{row['event']}: {row['n']} certificates (last issued {issued})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""Local SMTP sink for offline send tests and benchmarks.
+
+Accepts any message without authentication and discards it (or writes it to a
+directory), counting what it received. Point the app at it with backend
+"smtp", host 127.0.0.1, the chosen port and security "none":
+
+    python smtp_sink.py --port 1025 --save-dir outbox/
+"""
+import argparse
+import os
+import socketserver
+import threading
+import time
+import uuid
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def _read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                break
+            # Undo dot-stuffing
+            if line.startswith(b".."):
+                line = line[1:]
+            lines.append(line)
+        return b"".join(lines)
+
+    def handle(self):
+        self._reply("220 localhost CertificateSaathi SMTP sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip().split(" ", 1)[0].upper()
+            if command in ("EHLO", "HELO"):
+                self._reply("250-localhost")
+                self._reply("250 SIZE 52428800")
+            elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                self.server.store(self._read_data())
+                self._reply("250 OK queued")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class LocalSMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=1025, save_dir=None):
+        super().__init__((host, port), _SMTPHandler)
+        self.save_dir = save_dir
+        self.message_count = 0
+        self.byte_count = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    # Function to record a received message
+    def store(self, data):
+        with self._lock:
+            self.message_count += 1
+            self.byte_count += len(data)
+        if self.save_dir:
+            with open(os.path.join(self.save_dir, f"{uuid.uuid4().hex}.eml"), "wb") as eml_file:
+                eml_file.write(data)
+
+    # Function to serve from a background thread (used by tests and benchmarks)
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local SMTP server that accepts and discards mail.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--save-dir", help="Write received messages here as .eml files")
+    args = parser.parse_args(argv)
+
+    sink = LocalSMTPSink(args.host, args.port, args.save_dir)
+    print(f"SMTP sink listening on {args.host}:{sink.port}")
+    try:
+        sink.start()
+        while True:
+            time.sleep(5)
+            print(f"{sink.message_count} messages, {sink.byte_count / 1e6:.1f} MB received")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sink.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
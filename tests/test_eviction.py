@@ -0,0 +1,103 @@
+import os
+import time
+
+from PIL import Image
+
+import certificate_engine
+import jobs
+
+
+def text_elements():
+    return [{'field': 'Name', 'font_size': 30, 'color': '#000000', 'actual_x': 200, 'actual_y': 150}]
+
+
+def records(names):
+    return [
+        {'index': i, 'filename': f"{name}_certificate.png", 'texts': [name], 'email': None}
+        for i, name in enumerate(names)
+    ]
+
+
+def run_generation(store, root, cache_dir, names):
+    template = Image.new("RGB", (400, 300), "white")
+    job_id = jobs.submit_generation(store, template, text_elements(), records(names),
+                                    cache_dir=str(cache_dir), root=str(root))
+    runner = jobs.JobRunner(store, kinds=(), root=str(root), quota=0, cache_dir=str(cache_dir))
+    runner.run_job(store.claim_job("generate", runner.owner))
+    return store.get_job(job_id)
+
+
+def test_newest_job_survives_the_quota(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    cache_dir = tmp_path / "cache"
+    first = run_generation(store, tmp_path, cache_dir, ["Alice"])
+    assert first['status'] == "done"
+    assert store.get_job(first['id']) is not None
+
+    second = run_generation(store, tmp_path, cache_dir, ["Bob"])
+    assert store.get_job(second['id'])['status'] == "done"
+    assert store.get_job(first['id']) is None
+    assert not os.path.exists(tmp_path / first['id'])
+
+
+def test_shared_cache_files_are_counted_once(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    cache_dir = tmp_path / "cache"
+    job = run_generation(store, tmp_path, cache_dir, ["Alice", "Bob"])
+    certificates = job['result']['output_dir']
+    linked = sum(os.path.getsize(os.path.join(certificates, name)) for name in os.listdir(certificates))
+    cached = sum(size for _, _, size, _ in jobs.cache_entries(str(cache_dir)))
+    assert linked == cached
+    total = jobs.directory_size(str(tmp_path / job['id']))
+    assert total + cached == sum(
+        os.path.getsize(os.path.join(directory, name))
+        for directory, _, files in os.walk(tmp_path / job['id']) for name in files
+    )
+
+
+def test_cache_entries_go_with_their_jobs_or_ttl(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    cache_dir = tmp_path / "cache"
+    first = run_generation(store, tmp_path, cache_dir, ["Alice"])
+    run_generation(store, tmp_path, cache_dir, ["Bob"])
+    # Alice's job was evicted for the quota, and with it the last link to her cache entry
+    entries = jobs.cache_entries(str(cache_dir))
+    assert len(entries) == 1
+    assert store.get_job(first['id']) is None
+
+    # An entry still linked from a job stays; once the job expires, both go
+    later = time.time() + jobs.JOB_TTL + 1
+    jobs.evict_jobs(store, str(tmp_path), now=later, cache_dir=str(cache_dir))
+    assert jobs.cache_entries(str(cache_dir)) == []
+    assert store.jobs_by_age() == []
+
+
+def test_unused_cache_entries_expire(tmp_path):
+    cache_dir = tmp_path / "cache"
+    entry = certificate_engine.cache_path(str(cache_dir), "ab" * 32)
+    os.makedirs(os.path.dirname(entry))
+    Image.new("RGB", (10, 10)).save(entry)
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    jobs.evict_jobs(store, str(tmp_path), now=time.time() + 10, cache_dir=str(cache_dir))
+    assert os.path.exists(entry)
+    jobs.evict_jobs(store, str(tmp_path), now=time.time() + jobs.JOB_TTL + 10, cache_dir=str(cache_dir))
+    assert not os.path.exists(entry)
+
+
+def test_abandoned_paused_email_job_expires_with_its_certificates(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    cache_dir = tmp_path / "cache"
+    generation = run_generation(store, tmp_path, cache_dir, ["Alice"])
+    attachment = os.path.join(generation['result']['output_dir'], "Alice_certificate.png")
+    email_job = jobs.submit_email(store, "sender@example.com", jobs.SMTPSettings(), "Subject", "Body",
+                                  [("alice@example.com", attachment)], source_job=generation['id'])
+    store.set_status(email_job, "paused", error="Re-enter the email password to resume sending.")
+
+    jobs.evict_jobs(store, str(tmp_path), now=time.time() + 10, cache_dir=str(cache_dir))
+    assert store.get_job(email_job) is not None
+    assert store.get_job(generation['id']) is not None
+
+    jobs.evict_jobs(store, str(tmp_path), now=time.time() + jobs.JOB_TTL + 10, cache_dir=str(cache_dir))
+    assert store.get_job(email_job) is None
+    assert store.get_job(generation['id']) is None
+    assert not os.path.exists(tmp_path / generation['id'])
@@ -0,0 +1,21 @@
+import pandas as pd
+import pytest
+
+import ingest
+
+
+@pytest.mark.parametrize("extension", [".xlsx", ".csv", ".parquet"])
+def test_count_rows_matches_streamed_rows(tmp_path, extension):
+    df = pd.DataFrame({'Name': [f"Person {i}" for i in range(123)], 'Email': ["a@example.com"] * 123})
+    path = str(tmp_path / f"participants{extension}")
+    if extension == ".xlsx":
+        df.to_excel(path, index=False)
+    elif extension == ".csv":
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path, index=False)
+
+    streamed = sum(len(chunk) for chunk in ingest.iter_chunks(path, path, chunk_size=50))
+    assert ingest.count_rows(path, path) == streamed == 123
+    with open(path, "rb") as upload:
+        assert ingest.count_rows(upload, path) == 123
@@ -0,0 +1,99 @@
+import threading
+import time
+
+from PIL import Image
+
+import jobs
+from mailer import SMTPSettings
+from smtp_sink import LocalSMTPSink
+
+
+def text_elements():
+    return [{'field': 'Name', 'font_size': 30, 'color': '#000000', 'actual_x': 200, 'actual_y': 150}]
+
+
+def records(count=3):
+    return [
+        {'index': i, 'filename': f"Person_{i}_certificate.png", 'texts': [f"Person {i}"], 'email': None}
+        for i in range(count)
+    ]
+
+
+def submit(store, root, count=3):
+    template = Image.new("RGB", (400, 300), "white")
+    return jobs.submit_generation(store, template, text_elements(), records(count), root=str(root))
+
+
+def wait_until_finished(store, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = store.get_job(job_id)
+        if job['status'] in jobs.FINISHED_STATUSES:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_only_one_runner_claims_a_job(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    job_id = submit(store, tmp_path)
+    assert store.claim_job("generate", "runner-a")['id'] == job_id
+    assert store.claim_job("generate", "runner-b") is None
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    job_id = submit(store, tmp_path)
+    assert store.claim_job("generate", "runner-a", lease=-1)['id'] == job_id
+    assert store.claim_job("generate", "runner-b")['id'] == job_id
+    assert not store.renew_lease(job_id, "runner-a")
+
+
+def test_two_runners_run_a_job_once(tmp_path, monkeypatch):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    runs = []
+    lock = threading.Lock()
+    original = jobs.JobRunner._run_generation
+
+    def counting_run(self, job):
+        with lock:
+            runs.append(job['id'])
+        original(self, job)
+
+    monkeypatch.setattr(jobs.JobRunner, "_run_generation", counting_run)
+    runners = [
+        jobs.JobRunner(store, kinds=("generate",), poll_interval=0.01, root=str(tmp_path)).start()
+        for _ in range(2)
+    ]
+    try:
+        job_id = submit(store, tmp_path)
+        assert wait_until_finished(store, job_id)['status'] == "done"
+        time.sleep(0.2)
+    finally:
+        for runner in runners:
+            runner.stop()
+    assert runs == [job_id]
+
+
+def test_email_job_records_every_row_of_a_repeated_recipient(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    attachments = []
+    for name in ("first", "second"):
+        path = tmp_path / f"{name}.png"
+        Image.new("RGB", (10, 10), "white").save(path)
+        attachments.append(str(path))
+
+    with LocalSMTPSink(port=0) as sink:
+        settings = SMTPSettings(backend="smtp", host="127.0.0.1", port=sink.port, security="none")
+        recipients = [("alice@example.com", attachments[0]), ("alice@example.com", attachments[1])]
+        job_id = jobs.submit_email(store, "sender@example.com", settings, "Subject", "Body", recipients, workers=2)
+        runner = jobs.JobRunner(store, kinds=("email",), poll_interval=0.01, root=str(tmp_path)).start()
+        try:
+            job = wait_until_finished(store, job_id)
+        finally:
+            runner.stop()
+        received = sink.message_count
+
+    assert job['status'] == "done"
+    assert received == 2
+    assert store.row_counts(job_id) == {'done': 2}
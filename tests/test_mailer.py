@@ -0,0 +1,104 @@
+import smtplib
+
+import jobs
+import mailer
+from mailer import EmailDispatcher, SMTPMailer, SMTPSettings
+from smtp_sink import LocalSMTPSink
+
+
+class FlakyMailer:
+    # Refuses the recipient with each of the given replies, then accepts the message
+    def __init__(self, *refusals):
+        self.sender_email = "sender@example.com"
+        self.refusals = list(refusals)
+        self.sent = 0
+
+    def send_message(self, msg):
+        if self.refusals:
+            code = self.refusals.pop(0)
+            raise smtplib.SMTPRecipientsRefused({msg['To']: (code, b"try later")})
+        self.sent += 1
+
+
+def send_one(dispatcher):
+    return list(dispatcher.dispatch([("alice@example.com", "Subject", "Body", None)]))
+
+
+def test_throttled_recipient_is_retried():
+    mailer = FlakyMailer(450, 421)
+    [(_, success, _)] = send_one(EmailDispatcher(mailer, workers=1, backoff=0))
+    assert success
+    assert mailer.sent == 1
+
+
+def test_rejected_recipient_is_not_retried():
+    mailer = FlakyMailer(550)
+    [(_, success, message)] = send_one(EmailDispatcher(mailer, workers=1, backoff=0))
+    assert not success
+    assert "550" in message
+    assert mailer.refusals == []
+
+
+def test_daily_quota_is_shared_across_dispatchers(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    outcomes = []
+    for _ in range(3):
+        quota = jobs.DailySendQuota(store, "sender@example.com", 2)
+        dispatcher = EmailDispatcher(FlakyMailer(), workers=1, daily_quota=quota)
+        [(_, success, _)] = send_one(dispatcher)
+        outcomes.append(success)
+    assert outcomes == [True, True, False]
+    assert jobs.DailySendQuota(store, "other@example.com", 2).acquire()
+
+
+def test_send_recovers_when_every_idle_connection_dropped():
+    with LocalSMTPSink(port=0) as sink:
+        settings = SMTPSettings(backend="smtp", host="127.0.0.1", port=sink.port, security="none")
+        with SMTPMailer("sender@example.com", None, pool_size=2, settings=settings) as mailer:
+            idle = [mailer._acquire(), mailer._acquire()]
+            for server in idle:
+                # As if the server timed the connection out while it sat in the pool
+                server.close()
+                mailer._release(server)
+            success, message = mailer.send("alice@example.com", "Subject", "Body")
+        received = sink.message_count
+    assert success, message
+    assert received == 1
+
+
+def test_plaintext_relay_ignores_a_stored_password():
+    with LocalSMTPSink(port=0) as sink:
+        settings = SMTPSettings(backend="smtp", host="127.0.0.1", port=sink.port, security="none")
+        assert mailer.test_email_connection("sender@example.com", "gmail-app-password", settings) == (
+            True, "Connection successful"
+        )
+        with SMTPMailer("sender@example.com", "gmail-app-password", settings=settings) as relay:
+            assert relay.send("alice@example.com", "Subject", "Body")[0]
+        assert sink.message_count == 1
+
+
+def daily_count(store, sender):
+    with store._connect() as conn:
+        row = conn.execute("SELECT SUM(sent) AS n FROM daily_sends WHERE sender = ?", (sender,)).fetchone()
+    return row['n'] or 0
+
+
+def test_retries_charge_the_daily_quota_once(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    quota = jobs.DailySendQuota(store, "sender@example.com", 2)
+    throttled = FlakyMailer(450, 450, 421)
+    assert send_one(EmailDispatcher(throttled, workers=1, backoff=0, daily_quota=quota))[0][1]
+    assert daily_count(store, "sender@example.com") == 1
+    assert send_one(EmailDispatcher(FlakyMailer(), workers=1, daily_quota=quota))[0][1]
+
+
+def test_paced_out_message_does_not_use_the_daily_quota(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    quota = jobs.DailySendQuota(store, "sender@example.com", 10)
+    dispatcher = EmailDispatcher(FlakyMailer(), workers=1, per_second=1, quota_timeout=0, daily_quota=quota)
+    outcomes = [success for _, success, _ in dispatcher.dispatch([
+        ("alice@example.com", "Subject", "Body", None),
+        ("bob@example.com", "Subject", "Body", None),
+    ])]
+    assert sorted(outcomes) == [False, True]
+    assert daily_count(store, "sender@example.com") == 1
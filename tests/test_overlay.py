@@ -0,0 +1,70 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import certificate_engine
+import overlay
+
+
+def gradient_template(mode):
+    width, height = 320, 240
+    pixels = np.zeros((height, width, len(mode)), dtype=np.uint8)
+    pixels[..., 0] = np.arange(width, dtype=np.uint8)[None, :]
+    pixels[..., 1] = np.arange(height, dtype=np.uint8)[:, None]
+    pixels[..., 2] = 200
+    if mode == "RGBA":
+        pixels[..., 3] = np.linspace(64, 255, width, dtype=np.uint8)[None, :]
+    return Image.fromarray(pixels, mode)
+
+
+def element(y, size=24, x=160):
+    return {'field': 'Name', 'font_size': size, 'color': '#102030', 'actual_x': x, 'actual_y': y}
+
+
+def assert_matches_full_render(template, text_elements, texts):
+    encoder = overlay.OverlayPNGEncoder(template)
+    decoded = Image.open(io.BytesIO(encoder.encode(text_elements, texts)))
+    decoded.load()
+    expected = certificate_engine.render_certificate(template, text_elements, texts)
+    assert decoded.mode == expected.mode
+    assert np.array_equal(np.asarray(decoded), np.asarray(expected))
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+@pytest.mark.parametrize("texts, text_elements", [
+    (["Ada Lovelace"], [element(120)]),
+    (["Top edge"], [element(0)]),
+    (["Bottom edge"], [element(239)]),
+    (["Line one\nLine two"], [element(120)]),
+    (["One\nTwo\nThree\nFour"], [element(20, size=30)]),
+    (["Line one\nLine two", "Below"], [element(90), element(150)]),
+    ([None, "Second field only"], [element(60), element(180)]),
+])
+def test_overlay_matches_full_render(mode, texts, text_elements):
+    assert_matches_full_render(gradient_template(mode), text_elements, texts)
+
+
+def test_layouts_are_shared_by_line_count():
+    encoder = overlay.OverlayPNGEncoder(gradient_template("RGB"))
+    for text in ("Ada\nLovelace", "Grace\nHopper", "Alan Turing"):
+        encoder.encode([element(120)], [text])
+    assert len(encoder._layouts) == 2
+
+
+def test_qr_stamp_matches_full_render(tmp_path):
+    template = certificate_engine.ImageTemplate(gradient_template("RGB"))
+    path = tmp_path / "certificate.png"
+    template.write(str(path), [element(120)], ["Ada Lovelace"], qr_data="https://example.com/verify?id=cert_x")
+    code, position = template.qr_stamp("https://example.com/verify?id=cert_x")
+    expected = certificate_engine.render_certificate(template.image, [element(120)], ["Ada Lovelace"])
+    expected.paste(code, position)
+    assert np.array_equal(np.asarray(Image.open(path)), np.asarray(expected))
+
+
+def test_measure_profiles_skips_pdf_without_reportlab(monkeypatch):
+    monkeypatch.setattr(certificate_engine.pdf_output, "available", lambda: False)
+    measurements = certificate_engine.measure_profiles(gradient_template("RGB"), [element(120)], ["Ada"])
+    assert [m['profile'] for m in measurements] == ["print", "email", "archive"]
+    assert "pdf" not in certificate_engine.available_profiles()
@@ -0,0 +1,84 @@
+import json
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import Image
+
+import certificate_engine
+
+
+def text_elements():
+    return [{'field': 'Name', 'font_size': 30, 'color': '#000000', 'actual_x': 200, 'actual_y': 150}]
+
+
+def test_duplicate_names_get_distinct_filenames():
+    df = pd.DataFrame({'Name': ["Alice", "Bob", "Alice", "Alice"]})
+    records = certificate_engine.prepare_records(df, text_elements())
+    assert [record['filename'] for record in records] == [
+        "Alice_certificate.png", "Bob_certificate.png", "Alice_certificate_2.png", "Alice_certificate_3.png",
+    ]
+
+
+def test_filenames_stay_unique_across_chunks():
+    taken_filenames = set()
+    first = pd.DataFrame({'Name': ["Alice"]}, index=[0])
+    second = pd.DataFrame({'Name': ["Alice"]}, index=[1])
+    records = (certificate_engine.prepare_records(first, text_elements(), taken_filenames=taken_filenames)
+               + certificate_engine.prepare_records(second, text_elements(), taken_filenames=taken_filenames))
+    assert [record['filename'] for record in records] == ["Alice_certificate.png", "Alice_certificate_2.png"]
+
+
+def test_namesakes_get_their_own_certificate(tmp_path):
+    df = pd.DataFrame({'Name': ["Alice", "Alice"], 'Course': ["Maths", "Physics"]})
+    elements = text_elements() + [
+        {'field': 'Course', 'font_size': 30, 'color': '#000000', 'actual_x': 200, 'actual_y': 220},
+    ]
+    records = certificate_engine.prepare_records(df, elements)
+    template = Image.new("RGB", (400, 300), "white")
+    results = list(certificate_engine.render_batch(template, elements, records, str(tmp_path / "out")))
+
+    paths = {result['path'] for result in results}
+    assert len(paths) == 2
+
+    zip_path = tmp_path / "certificates.zip"
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        for result in results:
+            archive.write(result['path'], result['filename'])
+    with zipfile.ZipFile(zip_path) as archive:
+        contents = [archive.read(name) for name in archive.namelist()]
+    assert contents[0] != contents[1]
+
+
+def test_merged_pdf_pages_follow_rendered_rows(tmp_path, monkeypatch):
+    fitz = pytest.importorskip("pymupdf")
+    pytest.importorskip("reportlab")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CERTIFICATE_SECRET_KEY", "test")
+
+    Image.new("RGB", (400, 300), "white").save("template.png")
+    with open("layout.json", "w", encoding="utf-8") as layout_file:
+        json.dump(text_elements(), layout_file)
+    # The middle row only has an email, so it is kept although its name is empty
+    pd.DataFrame({
+        'Name': ["Alice", None, "Carol"],
+        'Email': ["alice@example.com", "bob@example.com", "carol@example.com"],
+    }).to_csv("participants.csv", index=False)
+
+    results = certificate_engine.generate_certificates(
+        "template.png", "participants.csv", "layout.json", "out", email_column="Email",
+        qr_url="https://example.com/verify/{cert_id}", merged_pdf="merged.pdf"
+    )
+    assert len(results) == 3
+    cv2 = pytest.importorskip("cv2")
+    detector = cv2.QRCodeDetector()
+    with fitz.open("merged.pdf") as merged:
+        assert merged.page_count == 3
+        page_codes = []
+        for page in merged:
+            pixmap = page.get_pixmap(dpi=600)
+            pixels = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+            page_codes.append(detector.detectAndDecode(np.ascontiguousarray(pixels[..., :3]))[0])
+    assert page_codes == [result['qr_data'] for result in results]
+    assert all(result['certificate_id'] in code for code, result in zip(page_codes, results))
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+import certificate_engine
+import registry
+
+CERT_ID = registry.derive_certificate_id(b"key", "Event", {'participant': "Ada", 'texts': ["Ada"], 'email': None})
+
+
+@pytest.mark.parametrize("scanned", [
+    CERT_ID,
+    f"  {CERT_ID}\n",
+    f"https://example.com/verify?id={CERT_ID}",
+    f"https://example.com/verify?event=2024&id={CERT_ID}&lang=en",
+    f"https://example.com/verify/{CERT_ID}",
+    f"https://example.com/verify/{CERT_ID}/",
+    f"https://example.com/c/{CERT_ID}#details",
+])
+def test_parse_certificate_id(scanned):
+    assert registry.parse_certificate_id(scanned) == CERT_ID
+
+
+def test_unrecognised_payload_is_returned_as_is():
+    assert registry.parse_certificate_id(" https://example.com/verify/unknown ") == "https://example.com/verify/unknown"
+
+
+def test_verify_finds_id_in_url_path(tmp_path):
+    certificates = registry.CertificateRegistry(str(tmp_path / "certificates.db"), key=b"key")
+    certificates.register([{'certificate_id': CERT_ID, 'event': "Event", 'participant': "Ada"}])
+    assert certificates.verify(f"https://example.com/verify/{CERT_ID}")['valid']
+
+
+def test_namesakes_get_distinct_ids_and_entries(tmp_path):
+    elements = [{'field': 'Name', 'font_size': 30, 'color': '#000000', 'actual_x': 200, 'actual_y': 150}]
+    records = certificate_engine.prepare_records(pd.DataFrame({'Name': ["Alice Smith", "Alice Smith"]}), elements)
+    ids = [registry.derive_certificate_id(b"key", "Event", record) for record in records]
+    assert ids[0] != ids[1]
+
+    # The ID does not change with the output format
+    webp = dict(records[0], filename=records[0]['filename'].replace(".png", ".webp"))
+    assert registry.derive_certificate_id(b"key", "Event", webp) == ids[0]
+
+    certificates = registry.CertificateRegistry(str(tmp_path / "certificates.db"), key=b"key")
+    certificates.register([
+        {'certificate_id': certificate_id, 'event': "Event", 'filename': record['filename']}
+        for certificate_id, record in zip(ids, records)
+    ])
+    assert [certificates.lookup(certificate_id)['filename'] for certificate_id in ids] == [
+        "Alice_Smith_certificate.png", "Alice_Smith_certificate_2.png",
+    ]
@@ -0,0 +1,48 @@
+import os
+
+from PIL import Image
+
+import certificate_engine
+
+
+def layout(color):
+    return [{'field': 'Name', 'font_size': 40, 'color': color, 'actual_x': 300, 'actual_y': 200}]
+
+
+def records():
+    return [
+        {'index': i, 'filename': f"Person_{i}_certificate.png", 'texts': [f"Person {i}"], 'email': None}
+        for i in range(2)
+    ]
+
+
+def render(template, text_elements, output_dir, cache_dir):
+    return list(certificate_engine.render_batch(template, text_elements, records(), str(output_dir),
+                                                cache_dir=str(cache_dir)))
+
+
+def read_pixels(path):
+    with Image.open(path) as image:
+        return image.convert("RGB").tobytes()
+
+
+# Rendering layout B into an output directory whose files are hard links to layout A's
+# cache entries must not rewrite those entries, so a later layout A run reuses A's pixels
+def test_rerender_does_not_overwrite_cache_entries(tmp_path):
+    template = Image.new("RGB", (600, 400), "white")
+    output_dir = tmp_path / "out"
+    cache_dir = tmp_path / "cache"
+
+    first = render(template, layout("#000000"), output_dir, cache_dir)
+    expected = {result['filename']: read_pixels(result['path']) for result in first}
+
+    second = render(template, layout("#ff0000"), output_dir, cache_dir)
+    assert not any(result['cached'] for result in second)
+    for result in second:
+        assert read_pixels(result['path']) != expected[result['filename']]
+
+    third = render(template, layout("#000000"), output_dir, cache_dir)
+    assert all(result['cached'] for result in third)
+    for result in third:
+        assert read_pixels(result['path']) == expected[result['filename']]
+        assert os.path.exists(result['path'])